@@ -0,0 +1,312 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image as PILImage
+from lark import Tree
+from Core import RuleCompiler
+from Core.Grammar import build_parser, get_parser
+from Core.SceneObject import ObjectType, SceneObject, extract_object_types
+from Core.RuleCompiler import _literal, compile_rules
+from Core.SceneRunner import check_scene
+from Core.VectorEval import check_batch, lower_rules
+from models.Registry import ModelRegistry
+from models.StubModels import STUB_REGISTRY_JSON
+
+BENCHMARK_FORMAT = "cfs-benchmark/1"
+
+BENCH_DSL = """
+type Scene {
+  attributes: [weather]
+  objects: [Group*, cube*, sphere?]
+}
+type Group {
+  attributes: [material]
+  objects: [Group*, cube+, sphere*]
+}
+type cube {
+  attributes: [material, size]
+  objects: []
+}
+type sphere {
+  attributes: [material]
+  objects: []
+}
+rule ManyCubes(s: Scene) {
+  if count(s.cube) > 2 then {
+    contradiction 1
+  }
+}
+rule NestedCubes(s: Scene) {
+  if count(s.Group.cube) > 4 then {
+    contradiction 2
+  }
+}
+rule GoldCube(s: Scene) {
+  for c in s.cube do {
+    if c.material = "gold" then {
+      contradiction 3
+    }
+    if c.size > 7 then {
+      contradiction 4
+    }
+  }
+}
+rule MirrorGroup(s: Scene) {
+  for g in s.Group do {
+    if g.material = "mirror" then {
+      contradiction 5
+    }
+  }
+}
+rule Rain(s: Scene) {
+  if s.weather = "rain" then {
+    contradiction 6
+  }
+}
+"""
+
+# (max_depth, fan_out) pairs: depth is how many levels below the root get children, fan_out the
+# upper bound of the "+" and "*" multiplicities (Parser.random_instance hard-codes 3 and 3).
+DEFAULT_SIZES = ((1, 3), (3, 3), (4, 4), (5, 5))
+
+
+# === Synthetic scenes ===
+def value_pools(tree: Tree) -> Dict[str, list]:
+    """Candidate values per attribute: the literals the rules compare it against, plus a few that never match."""
+    pools: Dict[str, list] = {}
+    for expr in tree.find_data("expr"):
+        attr, value = expr.children[1].value, _literal(expr.children[3])
+        pool = pools.setdefault(attr, [])
+        if isinstance(value, str):
+            pool.append(value)
+        else:
+            pool.extend(range(int(value) * 2 + 1))
+    return pools
+
+
+def child_count(multiplicity: str, rng: random.Random, fan_out: int) -> int:
+    """ObjectType.get_count_by_multiplicity with a seeded generator and a configurable upper bound."""
+    if multiplicity == "+":
+        return rng.randint(1, fan_out)
+    if multiplicity == "*":
+        return rng.randint(0, fan_out)
+    if multiplicity == "?":
+        return rng.randint(0, 1)
+    return 1
+
+
+def _random_value(attr: str, pools: Dict[str, list], rng: random.Random):
+    pool = pools.get(attr)
+    if pool and rng.random() < 0.8:
+        return rng.choice(pool)
+    return f"val_{rng.randint(0, 99)}"
+
+
+def random_instance(obj_type: ObjectType, type_map: Dict[str, ObjectType], rng: random.Random,
+                    pools: Dict[str, list], max_depth: int = 3, fan_out: int = 3, depth: int = 0) -> dict:
+    """A random scene tree in SceneObject.to_dict form; children stop at max_depth, like Parser's depth < 3."""
+    objects, empty = {}, []
+    for child_type, multiplicity in obj_type.ObjectList:
+        count = child_count(multiplicity, rng, fan_out) if depth < max_depth and child_type in type_map else 0
+        children = [random_instance(type_map[child_type], type_map, rng, pools, max_depth, fan_out, depth + 1)
+                    for _ in range(count)]
+        if children:
+            objects[child_type] = children
+        else:
+            empty.append(child_type)
+    return {
+        "type": obj_type.name,
+        "attributes": {attr: _random_value(attr, pools, rng) for attr in obj_type.attributes},
+        "objects": objects,
+        "empty": empty,
+    }
+
+
+def random_scenes(tree: Tree, root_type: str, count: int, seed: int = 0, max_depth: int = 3,
+                  fan_out: int = 3) -> List[SceneObject]:
+    """count reproducible scenes, fully materialized (replayed), so rules run without any model."""
+    type_map = {t.name: t for t in extract_object_types(tree)}
+    pools = value_pools(tree)
+    rng = random.Random(seed)
+    return [SceneObject.from_dict(random_instance(type_map[root_type], type_map, rng, pools, max_depth, fan_out))
+            for _ in range(count)]
+
+
+def stub_registry(latency: Optional[float] = None) -> ModelRegistry:
+    """Registry of the fixed-latency stub models; latency (seconds per image) overrides the segmentor's.
+
+    The override goes into the registry's entries, so it only applies to the models this registry builds.
+    """
+    if latency is None:
+        return ModelRegistry(STUB_REGISTRY_JSON)
+    args = {"StubSegmentor": {"latency": latency}, "StubClassifier": {"latency": latency / 2}}
+    return ModelRegistry([{**entry, "ARGS": args[entry["class"]]} for entry in STUB_REGISTRY_JSON])
+
+
+def random_images(count: int, seed: int = 0, size: Tuple[int, int] = (64, 64)) -> List[PILImage.Image]:
+    rng = np.random.default_rng(seed)
+    return [PILImage.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)) for _ in range(count)]
+
+
+# === Measurements ===
+def _timed(fn: Callable, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"median_ms": statistics.median(samples) * 1e3, "min_ms": min(samples) * 1e3}
+
+
+def bench_parse(text: str, repeat: int = 20) -> dict:
+    return {
+        "build_parser": _timed(lambda: build_parser(use_cache=False), max(3, repeat // 4)),
+        "build_parser_cached": _timed(build_parser, repeat),
+        "parse": _timed(lambda: get_parser().parse(text), repeat),
+        "chars": len(text),
+    }
+
+
+def bench_compile(tree: Tree, repeat: int = 20) -> dict:
+    def compile_cold():
+        # compile_rule_source memoizes by fingerprint; clear it so every repeat really compiles.
+        RuleCompiler._COMPILED.clear()
+        compile_rules(tree)
+
+    return {
+        "rules": len(list(tree.find_data("rule_def"))),
+        "compile": _timed(compile_cold, repeat),
+        "lower": _timed(lambda: lower_rules(tree), repeat),
+    }
+
+
+def bench_rules(tree: Tree, root_type: str, sizes: Sequence[Tuple[int, int]] = DEFAULT_SIZES, scenes: int = 200,
+                seed: int = 0, repeat: int = 3) -> List[dict]:
+    """Per scene size: objects and memory per scene, and scenes/s through the compiled and vector engines."""
+    compiled = list(compile_rules(tree).values())
+    vector = list(lower_rules(tree).values())
+    results = []
+    for max_depth, fan_out in sizes:
+        tracemalloc.start()
+        roots = random_scenes(tree, root_type, scenes, seed, max_depth, fan_out)
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        objects = sum(len(root.store) for root in roots)
+        compiled_s = _timed(lambda: [check_scene(compiled, root) for root in roots], repeat)["median_ms"] / 1e3
+        vector_s = _timed(lambda: check_batch(vector, roots), repeat)["median_ms"] / 1e3
+        results.append({
+            "max_depth": max_depth,
+            "fan_out": fan_out,
+            "scenes": scenes,
+            "objects_per_scene": objects / scenes,
+            "bytes_per_scene": allocated / scenes,
+            "store_bytes_per_scene": sum(root.store.nbytes() for root in roots) / scenes,
+            "compiled_scenes_per_s": scenes / compiled_s if compiled_s else None,
+            "vector_scenes_per_s": scenes / vector_s if vector_s else None,
+            "contradictions": sum(len(r) for r in check_batch(vector, roots)),
+        })
+    return results
+
+
+def bench_models(tree: Tree, root_type: str, images: int = 32, seed: int = 0, latency: float = 0.005) -> dict:
+    """Compiled rules over stub-model scenes: end-to-end scenes/s with a known model cost per image."""
+    type_map = {t.name: t for t in extract_object_types(tree)}
+    registry = stub_registry(latency)
+    rules = list(compile_rules(tree).values())
+    frames = random_images(images, seed)
+    start = time.perf_counter()
+    for image in frames:
+        root = SceneObject(root_type, root_type, source_image=image, model_registry=registry)
+        root.setup(type_map[root_type])
+        check_scene(rules, root)
+    elapsed = time.perf_counter() - start
+    return {"images": images, "latency_ms": latency * 1e3, "seconds": elapsed, "scenes_per_s": images / elapsed}
+
+
+def run_benchmarks(dsl: str = BENCH_DSL, root_type: str = "Scene", sizes: Sequence[Tuple[int, int]] = DEFAULT_SIZES,
+                   scenes: int = 200, seed: int = 0, images: int = 32, latency: float = 0.005) -> dict:
+    tree = get_parser().parse(dsl)
+    return {
+        "format": BENCHMARK_FORMAT,
+        "seed": seed,
+        "environment": {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform()},
+        "parse": bench_parse(dsl),
+        "compile": bench_compile(tree),
+        "rules": bench_rules(tree, root_type, sizes, scenes, seed),
+        "models": bench_models(tree, root_type, images, seed, latency),
+    }
+
+
+def _metrics(results: dict) -> Dict[str, Tuple[float, bool]]:
+    """Flat name -> (value, higher_is_better) for the comparable numbers of a results dict."""
+    metrics = {}
+    for section in ("parse", "compile"):
+        for name, value in results[section].items():
+            if isinstance(value, dict):
+                # Best-of-n is far less noisy than the median for these short timings.
+                metrics[f"{section}.{name}"] = (value["min_ms"], False)
+    for row in results["rules"]:
+        size = f"rules[{row['max_depth']}x{row['fan_out']}]"
+        metrics[f"{size}.bytes_per_scene"] = (row["bytes_per_scene"], False)
+        for engine in ("compiled", "vector"):
+            if row[f"{engine}_scenes_per_s"]:
+                metrics[f"{size}.{engine}_scenes_per_s"] = (row[f"{engine}_scenes_per_s"], True)
+    metrics["models.scenes_per_s"] = (results["models"]["scenes_per_s"], True)
+    return metrics
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.10) -> List[str]:
+    """Metrics that got worse than baseline by more than tolerance (a fraction), as readable lines."""
+    old, new = _metrics(baseline), _metrics(current)
+    regressions = []
+    for name, (value, higher_is_better) in new.items():
+        if name not in old or not old[name][0]:
+            continue
+        change = (value - old[name][0]) / old[name][0]
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {old[name][0]:.3f} -> {value:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark parsing, rule compilation and rule evaluation.")
+    parser.add_argument("output", nargs="?", default="benchmark.json")
+    parser.add_argument("--dsl", help="DSL file to benchmark instead of the built-in program")
+    parser.add_argument("--root-type", default="Scene")
+    parser.add_argument("--scenes", type=int, default=200)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.005, help="stub segmentor seconds per image")
+    parser.add_argument("--sizes", default=",".join(f"{d}x{f}" for d, f in DEFAULT_SIZES),
+                        help="comma-separated DEPTHxFANOUT scene sizes")
+    parser.add_argument("--compare", help="baseline results JSON; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    dsl = BENCH_DSL
+    if args.dsl:
+        with open(args.dsl, encoding="utf-8") as f:
+            dsl = f.read()
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",")]
+    results = run_benchmarks(dsl, args.root_type, sizes, args.scenes, args.seed, args.images, args.latency)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Benchmark results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print(f"[WARN] Regression: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
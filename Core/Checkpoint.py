@@ -0,0 +1,50 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+
+def ruleset_hash(fingerprints: Dict[str, Optional[str]], stop_after: Optional[int] = None) -> str:
+    """Hash of the rules a run checks and its stop_after policy; custom (non-DSL) rules count by name only."""
+    state = {name: fp or f"custom:{name}" for name, fp in fingerprints.items()}
+    if stop_after is not None:
+        # A stop_after run records truncated, cost-ordered results, which a full run must not resume from.
+        state = {"rules": state, "stop_after": stop_after}
+    canonical = json.dumps(state, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Checkpoint:
+    """Last completed image index per Check() call, valid only for the ruleset and model weights it was saved with.
+
+    Saved atomically (temp file + rename), so a crash mid-save leaves the previous checkpoint.
+    """
+
+    def __init__(self, path: str, ruleset: str, models: Dict[str, str]):
+        self.path = path
+        self.ruleset = ruleset
+        self.models = models
+        self.progress: Dict[str, int] = {}
+        self.resumed = False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("ruleset") == ruleset and state.get("models") == models:
+                self.progress = state.get("progress", {})
+                self.resumed = True
+            else:
+                print(f"[INFO] Checkpoint {path} was saved for other rules or model weights; starting over")
+
+    def next_index(self, call_key: str, start: int) -> int:
+        """First image index of a Check() call still to run."""
+        done = self.progress.get(call_key)
+        return start if done is None else max(start, done + 1)
+
+    def mark(self, call_key: str, index: int) -> None:
+        self.progress[call_key] = max(index, self.progress.get(call_key, index))
+
+    def save(self) -> None:
+        state = {"ruleset": self.ruleset, "models": self.models, "progress": self.progress}
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,48 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+import lark
+from lark import Lark, Tree
+from models.Profiler import PROFILER, profiled
+
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "grammar.lark")
+CACHE_DIR = os.path.join(os.path.dirname(GRAMMAR_PATH), ".lark_cache")
+
+_PARSER: Optional[Lark] = None
+_LOCK = threading.Lock()
+
+
+def _cache_path(grammar_text: str) -> Optional[str]:
+    digest = hashlib.sha256(f"{lark.__version__}\n{grammar_text}".encode()).hexdigest()[:16]
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    except OSError:
+        return None
+    return os.path.join(CACHE_DIR, f"grammar_{digest}.lalr")
+
+
+def build_parser(grammar_path: str = GRAMMAR_PATH, use_cache: bool = True) -> Lark:
+    with open(grammar_path, "r") as f:
+        grammar_text = f.read()
+    # Lark stores the LALR tables in the cache file; the name carries the grammar hash, so
+    # editing grammar.lark (or upgrading lark) simply builds and writes a new one.
+    cache = _cache_path(grammar_text) if use_cache else None
+    return Lark(grammar_text, start="start", parser="lalr", cache=cache or False)
+
+
+@profiled("get_parser")
+def get_parser() -> Lark:
+    """Process-wide DSL parser, built on first use."""
+    global _PARSER
+    if _PARSER is None:
+        with _LOCK:
+            if _PARSER is None:
+                _PARSER = build_parser()
+    return _PARSER
+
+
+def parse_dsl(text: str) -> Tree:
+    parser = get_parser()
+    with PROFILER.span("parse", chars=len(text)):
+        return parser.parse(text)
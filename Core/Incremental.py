@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from lark import Tree
+from Core.SceneObject import (SceneObject, SnapshotMiss, extract_object_types, extract_scenes, extract_method_calls,
+                              make_hierarchy)
+from Core.RuleCompiler import compile_rules, run_rule
+from Core.SceneRunner import index_scene_images, load_image, resolve_bound
+from Core.ResultsWriter import ResultsWriter, read_header, read_results
+from models.Query import configure_result_store, model_versions
+
+def image_key(image_path: str) -> str:
+    """Size and mtime of an image; it changes when the file is edited or replaced."""
+    stat = os.stat(image_path)
+    return f"{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class HierarchyCache:
+    """Materialized SceneObject hierarchies on disk, one JSON file per image.
+
+    Files are keyed by image path, size and mtime, so editing or replacing an image
+    invalidates its snapshot without hashing pixels, and by the model versions the
+    snapshot was resolved with, so new weights or another backend never reuse it.
+    """
+
+    def __init__(self, folder: str, models: Optional[Dict[str, str]] = None):
+        self.folder = folder
+        self.models = json.dumps(models or {}, sort_keys=True)
+        os.makedirs(folder, exist_ok=True)
+
+    def _file(self, image_path: str) -> str:
+        key = f"{os.path.abspath(image_path)}|{image_key(image_path)}|{self.models}"
+        return os.path.join(self.folder, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def load(self, image_path: str) -> Optional[SceneObject]:
+        try:
+            with open(self._file(image_path), encoding="utf-8") as f:
+                return SceneObject.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, image_path: str, root: SceneObject) -> None:
+        path = self._file(image_path)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(root.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+
+def load_results(path: str, models: Optional[Dict[str, str]] = None
+                 ) -> Tuple[Dict[str, Optional[str]], Dict[Tuple[str, str], dict]]:
+    """Read a results file back as (rule fingerprints, {(scene, image): record}).
+
+    With models given, a file written under other model versions reads back as empty.
+    """
+    header = read_header(path)
+    if header is None or header.get("stop_after") is not None:
+        # A stop_after run's results are truncated, so none of them can stand in for a full check.
+        return {}, {}
+    if models is not None and header.get("models") != models:
+        print(f"[INFO] {path} was written with other model weights or backends; re-checking every image")
+        return {}, {}
+    records = {(r["scene"], r["image"]): r for r in read_results(path) if "results" in r}
+    return header.get("rules", {}), records
+
+
+def _evaluate(rules: Dict[str, Callable], names: List[str], root: SceneObject) -> Dict[str, Optional[str]]:
+    memo = {}
+    return {name: run_rule(rules[name], root, memo) or None for name in names}
+
+
+def run_incremental(tree: Tree, results_path: str, cache_dir: str, rules: Optional[Dict[str, Callable]] = None,
+                    bindings: Optional[Dict[str, Optional[int]]] = None,
+                    store_path: Optional[str] = None) -> Iterator[dict]:
+    """Like run_program, but re-evaluate only rules whose rule_def changed since the last results_path.
+
+    Unchanged rules reuse their previous results, unless the image itself changed (its size or
+    mtime differs from the recorded one) or the models did (model_versions() differs from the
+    file's header), which makes every rule stale. Stale rules run against the cached hierarchy
+    of each image; only when a rule reads something that was never resolved (or there is no
+    snapshot yet) is the image loaded and every rule of the call run against the models.
+    Custom rules have no fingerprint and always re-run. Records stream back in folder order into
+    a temporary file that replaces results_path once the program finishes.
+    """
+    if store_path:
+        configure_result_store(store_path)
+    type_map = {t.name: t for t in extract_object_types(tree)}
+    scenes = {scene["name"]: scene for scene in extract_scenes(tree)}
+    bindings = bindings or {}
+    rules = {**compile_rules(tree), **(rules or {})}
+    fingerprints = {name: getattr(rule, "fingerprint", None) for name, rule in rules.items()}
+    versions = model_versions()
+    old_fingerprints, previous = load_results(results_path, versions)
+    changed = {name for name, fp in fingerprints.items() if fp is None or old_fingerprints.get(name) != fp}
+    cache = HierarchyCache(cache_dir, versions)
+    writer = ResultsWriter(results_path + ".tmp", compress="gzip" if results_path.endswith(".gz") else None,
+                           append=False)
+    writer.write_header({"rules": fingerprints, "models": versions})
+
+    for call in extract_method_calls(tree):
+        scene = scenes.get(call["caller"])
+        if scene is None:
+            raise ValueError(f"Check() on undefined scene: {call['caller']}")
+        missing = [name for name in call["rules"] if name not in rules]
+        if missing:
+            raise ValueError(f"Unknown rule(s) in {call['caller']}.Check: {', '.join(missing)}")
+        start = resolve_bound(call["start"], bindings)
+        end = resolve_bound(call["end"], bindings)
+        for index, path in index_scene_images(scene["path"], start, end):
+            key = image_key(path)
+            old = previous.get((scene["name"], path))
+            results = dict(old["results"]) if old is not None and old.get("image_key") == key else {}
+            stale = [name for name in call["rules"] if name in changed or name not in results]
+            if stale:
+                root = cache.load(path)
+                try:
+                    if root is None:
+                        raise SnapshotMiss(path)
+                    results.update(_evaluate(rules, stale, root))
+                except SnapshotMiss:
+                    root = make_hierarchy(scene["root_type"], type_map, load_image(path))
+                    results.update(_evaluate(rules, call["rules"], root))
+                    cache.save(path, root)
+            results = {name: results[name] for name in call["rules"]}
+            record = {"scene": scene["name"], "index": index, "image": path, "image_key": key, "results": results,
+                      "contradictions": [r for r in results.values() if r]}
+            writer.write(record)
+            yield record
+
+    writer.close()
+    os.replace(results_path + ".tmp", results_path)
@@ -0,0 +1,237 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from Core.SceneObject import make_hierarchy
+from Core.RuleAnalysis import RuleRequirements
+from Core.SceneRunner import check_scene, load_image
+from Core.VectorEval import VectorRule, check_batch
+from models import Query
+from models.Query import get_model_registry, is_attribute_key, is_object_key, prefetch_detections, segmentors_for
+from models.Profiler import PROFILER
+
+STAGES = ("decode", "detect", "classify", "rules")
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StagedPipeline:
+    """Threads per stage with bounded queues between stages; results come back in input order.
+
+    stages is a list of (name, fn, workers). Every item passes through each fn in turn, and up
+    to queue_size items wait between two stages, so a slow stage applies back-pressure instead
+    of letting decoded images pile up. torch and PIL release the GIL in their heavy calls, so
+    decode, forward passes and rule evaluation overlap. The first exception in any stage is
+    re-raised to the consumer.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, Callable, int]], queue_size: int = 4):
+        self.stages = [(name, fn, max(1, workers)) for name, fn, workers in stages]
+        self.queue_size = queue_size
+
+    def run(self, items: Iterable) -> Iterator:
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], stop), daemon=True)]
+        for position, (name, fn, workers) in enumerate(self.stages):
+            remaining = [workers]
+            lock = threading.Lock()
+            for n in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work, name=f"{name}-{n}", daemon=True,
+                    args=(fn, queues[position], queues[position + 1], remaining, lock, stop),
+                ))
+        for thread in threads:
+            thread.start()
+        try:
+            yield from self._collect(queues[-1])
+        finally:
+            stop.set()
+            for q in queues:
+                # Unblock any producer still waiting on a full queue.
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items: Iterable, out: queue.Queue, stop: threading.Event):
+        try:
+            for seq, item in enumerate(items):
+                if not self._put(out, (seq, item), stop):
+                    return
+        except BaseException as error:
+            self._put(out, (-1, _Failure(error)), stop)
+        self._put(out, _DONE, stop)
+
+    def _work(self, fn: Callable, inbox: queue.Queue, out: queue.Queue, remaining: List[int],
+              lock: threading.Lock, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                entry = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                # Let the other workers of this stage see the marker; the last one passes it on.
+                inbox.put(_DONE)
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(out, _DONE, stop)
+                return
+            seq, item = entry
+            if not isinstance(item, _Failure):
+                try:
+                    item = fn(item)
+                except BaseException as error:
+                    item = _Failure(error)
+            self._put(out, (seq, item), stop)
+
+    @staticmethod
+    def _collect(results: queue.Queue) -> Iterator:
+        pending: Dict[int, object] = {}
+        next_seq = 0
+        while True:
+            entry = results.get()
+            if entry is _DONE:
+                return
+            seq, item = entry
+            if isinstance(item, _Failure):
+                raise item.error
+            pending[seq] = item
+            while next_seq in pending:
+                yield pending.pop(next_seq)
+                next_seq += 1
+
+
+def _materialize(paths: List[str], roots: list, requirements: RuleRequirements, registry,
+                 attributes: bool = True) -> None:
+    """Run the segmentor lookups (and classifier batches, if attributes) the rules will need, ahead of the rule stage.
+
+    An attribute is only inferred for the children of the object keys some rule reads it on.
+    """
+    object_keys = sorted(key for key in requirements.object_keys if is_object_key(key, registry))
+    reads = {key: [] for key in object_keys}
+    if attributes:
+        for key, attribute in sorted(requirements.reads):
+            if key in reads and is_attribute_key(attribute, registry):
+                reads[key].append(attribute)
+    for path, root in zip(paths, roots):
+        with PROFILER.scene(path):
+            for key in object_keys:
+                children = root.get(key)
+                if isinstance(children, list) and children:
+                    for attribute in reads[key]:
+                        # Each get classifies a growing window of siblings, so this is a few batches.
+                        for child in children:
+                            child.get(attribute)
+
+
+def check_pipeline(paths: List[str], type_map, root_type: str, rules: List[Callable], batch_size: int = 4,
+                   stage_workers: Optional[Dict[str, int]] = None, queue_size: int = 4,
+                   model_names: Optional[List[str]] = None,
+                   requirements: Optional[RuleRequirements] = None,
+                   stop_after: Optional[int] = None) -> Iterator[Tuple[str, List[str]]]:
+    """Check images through decode -> detect -> classify -> rules thread stages; yields (path, contradictions) in order.
+
+    stage_workers sets the thread count per stage (default 2 decoders, 1 of everything else).
+    Each chunk's detections stay pinned in the detection cache from the detect stage until its
+    rules have run, so the queues can hold more images than the cache without re-segmenting.
+    The classify stage only runs ahead when requirements (from RuleAnalysis) are known and there
+    is no stop_after policy; otherwise attributes are resolved lazily by the rules themselves.
+    """
+    workers = {"decode": 2, "detect": 1, "classify": 1, "rules": 1, **(stage_workers or {})}
+    unknown = set(workers) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(sorted(unknown))}")
+    registry = get_model_registry()
+    if model_names is None:
+        registry.preload()
+    else:
+        registry.preload(model_names)
+    segmentor_names = [model.__class__.__name__ for model in segmentors_for(registry, model_names)]
+    cache = Query.DETECTION_CACHE
+    held: Dict[int, list] = {}
+    held_lock = threading.Lock()
+
+    def unpin(images) -> None:
+        for image in images:
+            for name in segmentor_names:
+                cache.unpin(name, image)
+
+    def release(chunk) -> None:
+        with held_lock:
+            images = held.pop(id(chunk), [])
+        unpin(images)
+
+    def decode(chunk):
+        images = []
+        for path in chunk:
+            with PROFILER.scene(path):
+                images.append(load_image(path))
+        return chunk, images
+
+    def detect(batch):
+        chunk, images = batch
+        with held_lock:
+            held[id(chunk)] = images
+        for image in images:
+            for name in segmentor_names:
+                cache.pin(name, image)
+        prefetch_detections(images, registry, batch_size, model_names)
+        return chunk, images
+
+    def classify(batch):
+        chunk, images = batch
+        roots = [make_hierarchy(root_type, type_map, image) for image in images]
+        if requirements is not None:
+            # Under an early-exit policy, attributes are left to the rules so skipped ones are never inferred.
+            _materialize(chunk, roots, requirements, registry, attributes=stop_after is None)
+        return chunk, roots
+
+    def evaluate(batch):
+        chunk, roots = batch
+        try:
+            if all(isinstance(rule, VectorRule) for rule in rules):
+                return chunk, check_batch(rules, roots, stop_after)
+            results = []
+            for path, root in zip(chunk, roots):
+                with PROFILER.scene(path):
+                    results.append(check_scene(rules, root, stop_after))
+            return chunk, results
+        finally:
+            release(chunk)
+
+    pipeline = StagedPipeline([
+        ("decode", decode, workers["decode"]),
+        ("detect", detect, workers["detect"]),
+        ("classify", classify, workers["classify"]),
+        ("rules", evaluate, workers["rules"]),
+    ], queue_size)
+    chunks = (paths[i:i + batch_size] for i in range(0, len(paths), batch_size))
+    try:
+        for chunk, results in pipeline.run(chunks):
+            yield from zip(chunk, results)
+    finally:
+        # Chunks dropped by a failure or an early close still hold their pins.
+        with held_lock:
+            leftover = list(held.values())
+            held.clear()
+        for images in leftover:
+            unpin(images)
@@ -0,0 +1,167 @@
+import gzip
+import json
+import os
+import time
+import zlib
+from typing import IO, Dict, Iterator, Optional, Set, Tuple
+
+RESULTS_FORMAT = "cfs-results/1"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _is_gzip(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+class ResultsWriter:
+    """Append-only JSON Lines results file: one header line, then one record per checked scene.
+
+    Records go straight to the file buffer, so memory stays flat however many scenes are
+    written. The buffer is flushed every flush_every records or flush_interval seconds
+    (and fsync'd when fsync is set), so a crash loses at most that much. compress="gzip"
+    (or a .gz path) writes a gzip stream; reopening an existing file appends a new gzip
+    member, which read_results reads back as one stream. A file torn by a crash is cut back
+    to its last complete record before anything is appended.
+    """
+
+    def __init__(self, path: str, compress: Optional[str] = None, flush_every: int = 100,
+                 flush_interval: Optional[float] = 5.0, fsync: bool = False, append: bool = True):
+        if compress not in (None, "gzip"):
+            raise ValueError(f"Unsupported compression: {compress}")
+        self.path = path
+        self.compress = compress or ("gzip" if path.endswith(".gz") else None)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        if append:
+            repair(path)
+        self.has_header = append and os.path.exists(path) and os.path.getsize(path) > 0
+        mode = "ab" if append else "wb"
+        self._raw: IO[bytes] = open(path, mode)
+        self._file = gzip.GzipFile(fileobj=self._raw, mode=mode) if self.compress else self._raw
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def write_header(self, header: dict) -> None:
+        """Start a run: every run appending to the file adds its own header line before its records."""
+        self._write({"format": RESULTS_FORMAT, **header})
+        self.has_header = True
+
+    def write(self, record: dict) -> None:
+        if not self.has_header:
+            self.write_header({})
+        self._write(record)
+        self._pending += 1
+        if self._pending >= self.flush_every or (
+                self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record).encode("utf-8") + b"\n")
+
+    def flush(self) -> None:
+        if self.compress:
+            # Z_SYNC_FLUSH: everything written so far can be decompressed even if the member never closes.
+            self._file.flush()
+        self._raw.flush()
+        if self.fsync:
+            os.fsync(self._raw.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self._raw.closed:
+            return
+        self.flush()
+        if self.compress:
+            self._file.close()
+        self._raw.close()
+
+    def __enter__(self) -> "ResultsWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _lines(path: str) -> Iterator[bytes]:
+    if not _is_gzip(path):
+        with open(path, "rb") as f:
+            yield from f
+        return
+    with gzip.open(path, "rb") as f:
+        try:
+            yield from f
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            # A writer that died mid-member leaves a truncated stream; keep what was flushed.
+            return
+
+
+def repair(path: str) -> None:
+    """Cut a results file left by a crashed writer back to its last complete record, so it can be appended to."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    if not _is_gzip(path):
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - (1 << 16))
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            f.truncate(end)
+        return
+    try:
+        with gzip.open(path, "rb") as f:
+            while f.read(1 << 20):
+                pass
+        return
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        pass
+    # A torn gzip member can't be followed by another one, so rewrite the readable part.
+    with gzip.open(path + ".repair", "wb") as out:
+        for line in _lines(path):
+            if line.endswith(b"\n"):
+                out.write(line)
+    os.replace(path + ".repair", path)
+
+
+def iter_results(path: str) -> Iterator[dict]:
+    """Every line of a results file as a dict (header included), stopping at a torn last line."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    for line in _lines(path):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            return
+
+
+def read_header(path: str) -> Optional[dict]:
+    for record in iter_results(path):
+        return record if record.get("format") == RESULTS_FORMAT else None
+    return None
+
+
+def completed_scenes(path: str, rules: Dict[str, Optional[str]],
+                     stop_after: Optional[int] = None) -> Set[Tuple[str, str]]:
+    """(scene, image) of every record written by a run with exactly these rule fingerprints and stop_after."""
+    done = set()
+    matching = False
+    for record in iter_results(path):
+        if "format" in record:
+            matching = record.get("rules") == rules and record.get("stop_after") == stop_after
+        elif matching:
+            done.add((record["scene"], record["image"]))
+    return done
+
+
+def read_results(path: str) -> Iterator[dict]:
+    """Scene records of a results file, skipping header lines (one per run that appended to it)."""
+    for record in iter_results(path):
+        if "format" not in record:
+            yield record
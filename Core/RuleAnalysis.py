@@ -0,0 +1,125 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from lark import Tree
+from models.Query import is_attribute_key, is_object_key, lookup_key, models_for_keys
+
+# Relative cost of answering one key, by the kind of model behind it. A segmentor pass is shared by
+# every object key on the image (and cached); a classifier runs again for every attribute and crop.
+MODEL_COSTS = {"SEGMENTOR": 1.0, "CLASSIFIER": 4.0}
+# Reading a key no model answers (a declared attribute or a plain child list) is nearly free.
+READ_COST = 0.01
+
+
+class RuleRequirements:
+    """Object keys (labels / object types) and attributes a set of rules can read.
+
+    Keys are resolved against registry's key index (the process-wide one when it is None).
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self.object_keys: Set[str] = set()
+        self.attributes: Set[str] = set()
+        # (object key, attribute): the attribute is read on objects found under that key.
+        self.reads: Set[Tuple[str, str]] = set()
+
+    @property
+    def keys(self) -> Set[str]:
+        return self.object_keys | self.attributes
+
+    def models(self) -> List[str]:
+        """Registry class names these rules need; everything else can stay unloaded."""
+        return models_for_keys(sorted(self.keys), self.registry)
+
+    def cost(self, costs: Optional[Dict[str, float]] = None) -> float:
+        """Estimated model cost of reading every key, from the kind of model that answers each one."""
+        costs = costs or MODEL_COSTS
+        total = 0.0
+        for key in self.keys:
+            total += max((costs.get(h.kind, READ_COST) for h in lookup_key(key, self.registry)),
+                         default=READ_COST)
+        return total
+
+    def update(self, other: "RuleRequirements") -> "RuleRequirements":
+        self.object_keys |= other.object_keys
+        self.attributes |= other.attributes
+        self.reads |= other.reads
+        return self
+
+    def __repr__(self):
+        return (f"RuleRequirements(objects={sorted(self.object_keys)}, attributes={sorted(self.attributes)}, "
+                f"reads={sorted(self.reads)})")
+
+
+def _is_object_key(key: str, type_map: Dict, registry=None) -> bool:
+    if key in type_map or any(key == child for tdef in type_map.values() for child, _ in tdef.ObjectList):
+        return True
+    return is_object_key(key, registry)
+
+
+def _is_declared_attribute(key: str, type_map: Dict) -> bool:
+    return any(key in tdef.attributes for tdef in type_map.values())
+
+
+def _classify_path(parts: List[str], type_map: Dict, req: RuleRequirements, owner: Optional[str] = None):
+    """owner is the object key the path starts from (a loop variable's), None for the rule's root."""
+    for position, part in enumerate(parts):
+        if _is_object_key(part, type_map, req.registry):
+            req.object_keys.add(part)
+            owner = part
+        elif (is_attribute_key(part, req.registry) or _is_declared_attribute(part, type_map)
+              or position == len(parts) - 1):
+            req.attributes.add(part)
+            if owner is not None:
+                req.reads.add((owner, part))
+        else:
+            req.object_keys.add(part)
+            owner = part
+
+
+def _condition_requirements(condition: Tree, type_map: Dict, req: RuleRequirements, owner: Optional[str] = None,
+                            loop_var: Optional[str] = None):
+    """owner is the object key loop_var iterates over; it only applies to conditions that read loop_var."""
+    node = condition.children[0] if condition.data == "condition" else condition
+    variable = (node.children[0].children[0] if node.data == "count_condition" else node.children[0]).value
+    if variable != loop_var:
+        owner = None
+    if node.data == "count_condition":
+        _classify_path([t.value for t in node.children[0].children][1:], type_map, req, owner)
+    elif node.data == "expr":
+        req.attributes.add(node.children[1].value)
+        if owner is not None:
+            req.reads.add((owner, node.children[1].value))
+
+
+def rule_requirements(rule_tree: Tree, type_map: Optional[Dict] = None, registry=None) -> RuleRequirements:
+    type_map = type_map or {}
+    req = RuleRequirements(registry)
+    for node in rule_tree.children[3].children:
+        if not isinstance(node, Tree):
+            continue
+        if node.data == "for_stmt":
+            loop_var, owner = node.children[0].value, node.children[2].value
+            req.object_keys.add(owner)
+            if_stmts = node.children[3:]
+        else:
+            loop_var, owner, if_stmts = None, None, [node]
+        for if_stmt in if_stmts:
+            _condition_requirements(if_stmt.children[0], type_map, req, owner, loop_var)
+    return req
+
+
+def ruleset_requirements(rule_trees: Iterable[Tree], type_map: Optional[Dict] = None,
+                         registry=None) -> RuleRequirements:
+    req = RuleRequirements(registry)
+    for rule_tree in rule_trees:
+        req.update(rule_requirements(rule_tree, type_map, registry))
+    return req
+
+
+def order_by_cost(names: List[str], rule_trees: Dict[str, Tree], type_map: Optional[Dict] = None,
+                  costs: Optional[Dict[str, float]] = None, registry=None) -> List[str]:
+    """names sorted cheapest first (stable); rules without a rule_def (custom callables) go last."""
+    def cost(name: str) -> float:
+        tree = rule_trees.get(name)
+        return rule_requirements(tree, type_map, registry).cost(costs) if tree is not None else float("inf")
+    return sorted(names, key=cost)
@@ -0,0 +1,201 @@
+import ast
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple
+from lark import Tree
+
+PY_COMPARE = {"=": "==", "!=": "!=", ">": ">", "<": "<", ">=": ">=", "<=": "<="}
+
+
+# === Runtime helpers referenced by generated code ===
+# Every helper takes the memo of the scene being checked (None when a rule is called on its own).
+# It holds each (object, key) read and each (object, path) resolved by any rule of the ruleset,
+# and a path reuses its longest prefix, so the field paths of all rules form one shared DAG that
+# is filled in lazily: nothing is computed before a rule asks for it, nothing twice.
+def _get(obj, key: str, memo: Optional[dict] = None):
+    if memo is None:
+        return obj.get(key)
+    token = (obj, key)
+    if token in memo:
+        return memo[token]
+    value = memo[token] = obj.get(key)
+    return value
+
+
+def _children(obj, key: str, memo: Optional[dict] = None) -> list:
+    value = _get(obj, key, memo) if obj is not None else None
+    return value if isinstance(value, list) else []
+
+
+def _step(values: list, part: str, memo: Optional[dict]) -> list:
+    step = []
+    for value in values:
+        result = _get(value, part, memo)
+        if isinstance(result, list):
+            step.extend(result)
+        elif result is not None:
+            step.append(result)
+    return step
+
+
+def _resolve(obj, path: Tuple[str, ...], memo: Optional[dict] = None) -> list:
+    """Follow a dotted path from obj, flattening object lists; drops missing values."""
+    if memo is None:
+        values = [obj]
+        for part in path:
+            values = _step(values, part, None)
+        return values
+    token = (obj, path)
+    values = memo.get(token)
+    if values is None:
+        values = _step(_resolve(obj, path[:-1], memo) if len(path) > 1 else [obj], path[-1], memo)
+        memo[token] = values
+    return values
+
+
+def _count(obj, path: Tuple[str, ...], memo: Optional[dict] = None) -> int:
+    return len(_resolve(obj, path, memo))
+
+
+def _num(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+RUNTIME = {"_get": _get, "_children": _children, "_resolve": _resolve, "_count": _count, "_num": _num}
+
+
+# === Tree helpers ===
+def canonical_rule_text(node) -> str:
+    """Whitespace-independent serialization of a rule_def tree, used for hashing."""
+    if isinstance(node, Tree):
+        return f"{node.data}(" + " ".join(canonical_rule_text(c) for c in node.children) + ")"
+    return node.value
+
+
+def rule_fingerprint(rule_tree: Tree) -> str:
+    return hashlib.sha256(canonical_rule_text(rule_tree).encode()).hexdigest()
+
+
+def _literal(value_tree: Tree):
+    token = value_tree.children[0]
+    if token.type == "STRING":
+        return ast.literal_eval(token.value)
+    number = float(token.value)
+    return int(number) if number.is_integer() and "." not in token.value else number
+
+
+# === Code generation ===
+def _var(name: str) -> str:
+    # DSL identifiers are prefixed so they can never clash with keywords or the runtime helpers.
+    return f"v_{name}"
+
+
+def _condition_source(condition: Tree) -> str:
+    node = condition.children[0] if condition.data == "condition" else condition
+    if node.data == "count_condition":
+        parts = [t.value for t in node.children[0].children]
+        op = PY_COMPARE[node.children[1].value]
+        value = _literal(node.children[2])
+        left = f"_count({_var(parts[0])}, {tuple(parts[1:])!r}, _memo)"
+        if isinstance(value, str):
+            return f"{left} {op} _num({value!r})"
+        return f"{left} {op} {value!r}"
+
+    if node.data == "expr":
+        var, attr = node.children[0].value, node.children[1].value
+        op = PY_COMPARE[node.children[2].value]
+        value = _literal(node.children[3])
+        left = f"_get({_var(var)}, {attr!r}, _memo)"
+        if op in ("==", "!="):
+            if isinstance(value, str):
+                return f"{left} {op} {value!r}"
+            return f"_num({left}) {op} {value!r}"
+        if isinstance(value, str):
+            return f"({left} or '') {op} {value!r}"
+        return f"_num({left}) {op} {value!r}"
+
+    raise ValueError(f"Unsupported condition: {node.data}")
+
+
+def _if_source(if_stmt: Tree, indent: str) -> List[str]:
+    condition = next(c for c in if_stmt.children if isinstance(c, Tree) and c.data != "contradiction")
+    code = next(c for c in if_stmt.children if isinstance(c, Tree) and c.data == "contradiction").children[0].value
+    return [f"{indent}if {_condition_source(condition)}:",
+            f"{indent}    return {'contradiction ' + code!r}"]
+
+
+def rule_to_python(rule_tree: Tree) -> str:
+    name, param = rule_tree.children[0].value, rule_tree.children[1].value
+    body = rule_tree.children[3]
+    lines = [f"def {_var(name)}({_var(param)}, _memo=None):"]
+    for node in body.children:
+        if not isinstance(node, Tree):
+            continue
+        if node.data == "for_stmt":
+            var, container, child = (t.value for t in node.children[:3])
+            lines.append(f"    for {_var(var)} in _children({_var(container)}, {child!r}, _memo):")
+            for if_stmt in node.children[3:]:
+                lines.extend(_if_source(if_stmt, "        "))
+        elif node.data == "if_stmt":
+            lines.extend(_if_source(node, "    "))
+    lines.append("    return None")
+    return "\n".join(lines) + "\n"
+
+
+# === Compilation ===
+class CompiledRule:
+    """A DSL rule compiled to a Python function; pickles as source so pool workers can rebuild it.
+
+    Calling it with the memo of a scene shares field reads and path results with the other
+    rules checked against that scene (see SceneRunner.check_scene).
+    """
+    __slots__ = ("name", "fingerprint", "source", "fn")
+
+    def __init__(self, name: str, fingerprint: str, source: str, fn: Callable):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.source = source
+        self.fn = fn
+
+    def __call__(self, scene, memo: Optional[dict] = None):
+        return self.fn(scene, memo)
+
+    def __reduce__(self):
+        return (compile_rule_source, (self.name, self.fingerprint, self.source))
+
+    def __repr__(self):
+        return f"<CompiledRule {self.name} {self.fingerprint[:12]}>"
+
+
+_COMPILED: Dict[str, CompiledRule] = {}
+
+
+def compile_rule_source(name: str, fingerprint: str, source: str) -> CompiledRule:
+    cached = _COMPILED.get(fingerprint)
+    if cached is not None:
+        return cached
+    namespace = dict(RUNTIME)
+    exec(compile(source, f"<rule {name}>", "exec"), namespace)
+    rule = CompiledRule(name, fingerprint, source, namespace[_var(name)])
+    _COMPILED[fingerprint] = rule
+    return rule
+
+
+def compile_rule(rule_tree: Tree) -> CompiledRule:
+    """Compile one rule_def tree; identical rules are compiled once per process."""
+    fingerprint = rule_fingerprint(rule_tree)
+    cached = _COMPILED.get(fingerprint)
+    if cached is not None:
+        return cached
+    return compile_rule_source(rule_tree.children[0].value, fingerprint, rule_to_python(rule_tree))
+
+
+def compile_rules(tree: Tree) -> Dict[str, CompiledRule]:
+    return {stmt.children[0].value: compile_rule(stmt) for stmt in tree.find_data("rule_def")}
+
+
+def run_rule(rule: Callable, scene, memo: Optional[dict] = None):
+    """Call rule on scene, sharing memo when it is a CompiledRule; other callables just get the scene."""
+    return rule(scene, memo) if isinstance(rule, CompiledRule) else rule(scene)
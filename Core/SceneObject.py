@@ -1,9 +1,17 @@
 import random
-from typing import Dict, List, Tuple, Optional
+from array import array
+from typing import Dict, Iterator, List, Tuple, Optional, Union
 from PIL import Image as PILImage
 from lark import Tree, Token
 from collections import defaultdict
-from models.Query import load_model_registry, query
+from collections.abc import MutableMapping
+from Core.SceneStore import UNSET, SceneStore
+from models.Query import get_model_registry, is_attribute_key, query, query_batch
+from models.Detection import Detection
+from models.Profiler import profiled
+
+# Smallest classifier batch when an attribute is read inside a loop; it doubles as the loop goes on.
+ATTRIBUTE_BATCH = 8
 
 class ObjectType:
     def __init__(self, name: str, attributes: List[str], ObjectList: List[Tuple[str, str]]):
@@ -18,52 +26,346 @@ class ObjectType:
             "?": random.randint(0, 1)
         }.get(mult, 1)
 
+class SnapshotMiss(KeyError):
+    """A replayed hierarchy was asked for a key that was never resolved when it was saved."""
+
+
+class AttributeView(MutableMapping):
+    """The attributes dict of one SceneObject, read from and written to its store's columns."""
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: SceneStore, row: int):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key: str):
+        if key not in self.store.attribute_keys(self.row):
+            raise KeyError(key)
+        return self.store.attribute(self.row, key)
+
+    def __setitem__(self, key: str, value):
+        self.store.set_attribute(self.row, key, value)
+
+    def __delitem__(self, key: str):
+        self.store.set_attribute(self.row, key, None)
+
+    def __contains__(self, key) -> bool:
+        return key in self.store.attribute_keys(self.row)
+
+    def __iter__(self):
+        return iter(self.store.attribute_keys(self.row))
+
+    def __len__(self) -> int:
+        return len(self.store.attribute_keys(self.row))
+
+
+class ChildList(list):
+    """One child list of a SceneObject; append, insert, del and the other list edits are written to the store."""
+    __slots__ = ("owner", "key")
+
+    def __init__(self, owner: 'SceneObject', key: str, objects: List['SceneObject']):
+        super().__init__(objects)
+        self.owner = owner
+        self.key = key
+
+    def append(self, obj: 'SceneObject') -> None:
+        owner = self.owner
+        row = owner._adopt(obj)
+        owner.store._group(owner.row, self.key).append(row)
+        owner.store.parents[row] = owner.row
+        list.append(self, obj)
+
+    def _sync(self) -> None:
+        owner = self.owner
+        rows = [owner._adopt(obj) for obj in self]
+        owner.store.set_children(owner.row, self.key, rows)
+
+
+def _writes_through(name: str):
+    method = getattr(list, name)
+
+    def edit(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._sync()
+        return result
+    return edit
+
+
+for _name in ("extend", "insert", "remove", "pop", "clear", "sort", "reverse", "__setitem__", "__delitem__",
+              "__iadd__"):
+    setattr(ChildList, _name, _writes_through(_name))
+
+
+class ObjectListView(MutableMapping):
+    """The ObjectList dict of one SceneObject; lists are built on access and edits to them reach the store."""
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: SceneStore, row: int):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key: str) -> ChildList:
+        rows = self.store.child_rows(self.row, key)
+        if rows is None:
+            if key not in self.store.object_keys(self.row):
+                raise KeyError(key)
+            rows = ()
+        return ChildList(SceneObject.view(self.store, self.row), key, [SceneObject.view(self.store, row) for row in rows])
+
+    def __setitem__(self, key: str, objects: List['SceneObject']):
+        owner = SceneObject.view(self.store, self.row)
+        self.store.set_children(self.row, key, [owner._adopt(obj) for obj in objects])
+
+    def __delitem__(self, key: str):
+        self.store.set_children(self.row, key, [])
+
+    def __contains__(self, key) -> bool:
+        return key in self.store.object_keys(self.row)
+
+    def __iter__(self):
+        return iter(self.store.object_keys(self.row))
+
+    def __len__(self) -> int:
+        return len(self.store.object_keys(self.row))
+
+
 class SceneObject:
-    def __init__(self,typeId, type_name: str, source_image: Optional[PILImage.Image] = None, model_registry=None):
-        self.type = type_name
-        self.attributes: Dict[str, Optional[str]] = {}
-        self.ObjectList: Dict[str, List['SceneObject']] = {}
-        self.source_image: Optional[PILImage.Image] = source_image
-        self.model_registry = model_registry or load_model_registry()
+    """A view of one row of a SceneStore.
+
+    Constructing a SceneObject directly starts a new single-object store; objects found by
+    queries are added as rows of their parent's store, so a whole scene shares one set of
+    columns, one registry reference and one image reference. When a standalone tree is added
+    to another one, its views follow their rows into the new store on next access.
+    """
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, typeId, type_name: str, source_image: Union[PILImage.Image, Detection, None] = None,
+                 model_registry=None):
+        # The source is either a full image or a Detection whose crop is only cut when a model needs pixels.
+        self._store = SceneStore(model_registry if model_registry is not None else get_model_registry())
+        self._row = self._store.add(type_name, source_image)
+
+    @classmethod
+    def view(cls, store: SceneStore, row: int) -> 'SceneObject':
+        obj = cls.__new__(cls)
+        obj._store = store
+        obj._row = row
+        return obj
+
+    @property
+    def store(self) -> SceneStore:
+        if self._store.moved is not None:
+            self._follow()
+        return self._store
+
+    @property
+    def row(self) -> int:
+        if self._store.moved is not None:
+            self._follow()
+        return self._row
+
+    def _follow(self) -> None:
+        store, row = self._store, self._row
+        while store.moved is not None and store.moved[1][row] != UNSET:
+            store, row = store.moved[0], store.moved[1][row]
+        self._store, self._row = store, row
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SceneObject) and self.store is other.store and self.row == other.row
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.row))
+
+    @property
+    def type(self) -> str:
+        return self.store.type_name(self.row)
+
+    @property
+    def attributes(self) -> AttributeView:
+        return AttributeView(self.store, self.row)
+
+    @property
+    def ObjectList(self) -> ObjectListView:
+        return ObjectListView(self.store, self.row)
+
+    @property
+    def model_registry(self):
+        return self.store.model_registry
+
+    @model_registry.setter
+    def model_registry(self, registry):
+        self.store.model_registry = registry
+
+    @property
+    def replayed(self) -> bool:
+        return self.store.replayed
+
+    @property
+    def _source(self) -> Union[PILImage.Image, Detection, None]:
+        return self.store.sources[self.row]
+
+    @property
+    def source_image(self) -> Optional[PILImage.Image]:
+        source = self._source
+        return source.crop if isinstance(source, Detection) else source
+
+    @property
+    def detection(self) -> Optional[Detection]:
+        source = self._source
+        return source if isinstance(source, Detection) else None
+
+    @property
+    def siblings(self) -> Optional[List['SceneObject']]:
+        """Objects detected together with this one; attribute inference is batched across them."""
+        store, row = self.store, self.row
+        parent = store.parents[row]
+        for key in store.child_keys.get(parent, ()):
+            rows = store.children[(parent, key)]
+            if row in rows:
+                return [SceneObject.view(store, r) for r in rows]
+        return None
 
     def setup(self, obj_type: ObjectType):
-        for attr in obj_type.attributes:
-            self.attributes[attr] = None
-        for child_name, _ in obj_type.ObjectList:
-            self.ObjectList[child_name] = []
+        self.store.declare(self.row, obj_type.attributes, [child_name for child_name, _ in obj_type.ObjectList])
+
+    def _adopt(self, obj: 'SceneObject') -> int:
+        """Row of obj in this store, bringing its subtree over if it lives in another store.
+
+        An object that is the root of its own store (built on its own, then added) is moved: that
+        store forwards every copied row, so obj and any view of its descendants now read and write
+        this tree. An object from another scene's tree is copied and stays where it was.
+        """
+        if obj.store is self.store:
+            return obj.row
+        source = obj.store
+        if obj.row == 0 and source.parents[0] == UNSET:
+            rows = array("i", [UNSET]) * len(source)
+            row = self._copy(obj, rows)
+            source.moved = (self.store, rows)
+            return row
+        return self._copy(obj)
+
+    def _copy(self, obj: 'SceneObject', rows: Optional[array] = None) -> int:
+        row = self.store.add(obj.type, obj._source, self.row)
+        if rows is not None:
+            rows[obj.row] = row
+        if obj.store.type_ids[obj.row] in obj.store.declared:
+            self.store.declared.setdefault(self.store.type_ids[row], obj.store.declared[obj.store.type_ids[obj.row]])
+        for key in obj.store.attribute_keys(obj.row):
+            value = obj.store.attribute(obj.row, key)
+            if value is not None:
+                self.store.set_attribute(row, key, value)
+        adopted = SceneObject.view(self.store, row)
+        for key in obj.store.child_keys.get(obj.row, ()):
+            copied = [adopted._copy(SceneObject.view(obj.store, r), rows) for r in obj.store.children[(obj.row, key)]]
+            self.store.set_children(row, key, copied)
+        self.store.mark_queried(row, obj.store.queried_keys(obj.row))
+        return row
 
     def add_object(self, obj: 'SceneObject'):
-        if obj.type not in self.ObjectList:
-            self.ObjectList[obj.type] = []
-        self.ObjectList[obj.type].append(obj)
+        row = self._adopt(obj)
+        self.store._group(self.row, obj.type).append(row)
+        self.store.parents[row] = self.row
 
+    @profiled("SceneObject.get")
     def get(self, key: str):
-        if key in self.attributes:
-            if self.attributes[key] is None and self.source_image:
-                result = query(self.source_image, key, self.model_registry)
-                self.attributes[key] = result
-            return self.attributes[key]
-
-        if self.source_image:
-            children = query(self.source_image, key, self.model_registry)
+        if self.store.replayed:
+            return self._replay(key)
+        store, row = self.store, self.row
+        if key in store.attribute_keys(row):
+            if store.attribute(row, key) is None and store.sources[row] is not None:
+                self._resolve_attribute(key)
+            return store.attribute(row, key)
+
+        if store.sources[row] is not None:
+            if is_attribute_key(key, store.model_registry):
+                self._resolve_attribute(key)
+                return store.attribute(row, key)
+            if store.was_queried(row, key):
+                return self.ObjectList.get(key)
+            store.mark_queried(row, (key,))
+            children = query(store.sources[row], key, store.model_registry)
             if isinstance(children, list):
-                scene_objects = []
-                for id, label_id, crop in children:
-                    child = SceneObject(id,label_id, source_image=crop, model_registry=self.model_registry)
-                    scene_objects.append(child)
-                self.ObjectList[key] = scene_objects
-                return scene_objects
+                rows = [store.add(label_id, det, row) for _, label_id, det in children]
+                store.set_children(row, key, rows)
+                return [SceneObject.view(store, r) for r in rows]
 
         return None
 
+    def _resolve_attribute(self, key: str):
+        store = self.store
+        siblings = self.siblings or [self]
+        start = siblings.index(self) if self in siblings else 0
+        resolved = sum(1 for obj in siblings if store.attribute(obj.row, key) is not None)
+        # Rules walk siblings in order and may return at the first hit, so classify a window from this
+        # object on rather than the whole group: batches stay large, and an early exit wastes at most half.
+        window = max(ATTRIBUTE_BATCH, resolved)
+        pending = [obj for obj in siblings[start:] if store.attribute(obj.row, key) is None
+                   and obj._source is not None][:window]
+        if self not in pending:
+            pending.insert(0, self)
+        # Sources go down unmaterialized so the result store can be consulted before any crop is cut.
+        results = query_batch([obj._source for obj in pending], key, store.model_registry)
+        for obj, result in zip(pending, results):
+            store.set_attribute(obj.row, key, result)
+
+    def _replay(self, key: str):
+        value = self.store.attribute(self.row, key)
+        if value is not None:
+            return value
+        if self.store.was_queried(self.row, key):
+            return self.ObjectList.get(key)
+        raise SnapshotMiss(key)
+
+    def to_dict(self) -> dict:
+        """Everything resolved so far (attributes and queried object lists), for replay without the image."""
+        store, row = self.store, self.row
+        queried = sorted(store.queried_keys(row))
+        return {
+            "type": self.type,
+            "attributes": {k: v for k, v in self.attributes.items() if v is not None},
+            "objects": {k: [child.to_dict() for child in self.ObjectList[k]]
+                        for k in queried if store.child_rows(row, k) is not None},
+            "empty": [k for k in queried if store.child_rows(row, k) is None],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, model_registry=None) -> 'SceneObject':
+        obj = cls(data["type"], data["type"], model_registry=model_registry)
+        obj.store.replayed = True
+        obj._load(data)
+        return obj
+
+    def _load(self, data: dict):
+        store, row = self.store, self.row
+        for key, value in data["attributes"].items():
+            store.set_attribute(row, key, value)
+        store.mark_queried(row, data["empty"])
+        for key, children in data["objects"].items():
+            rows = [store.add(child["type"], None, row) for child in children]
+            store.set_children(row, key, rows)
+            store.mark_queried(row, (key,))
+            for child_row, child in zip(rows, children):
+                SceneObject.view(store, child_row)._load(child)
+
+    def iter_all(self, type_name: str) -> Iterator['SceneObject']:
+        """Objects of type_name in this subtree, depth first, without recursion."""
+        store = self.store
+        code = store._type_codes.get(type_name)
+        if code is None:
+            return
+        for row in store.iter_rows(self.row):
+            if store.type_ids[row] == code:
+                yield SceneObject.view(store, row)
+
     def find_all(self, type_name: str) -> List['SceneObject']:
-        results = []
-        if self.type == type_name:
-            results.append(self)
-        for lst in self.ObjectList.values():
-            for child in lst:
-                results.extend(child.find_all(type_name))
-        return results
+        """Objects of type_name under this one; on a scene root this is a type-index lookup (creation order)."""
+        store = self.store
+        if self.row == 0 and not store.detached:
+            code = store._type_codes.get(type_name)
+            rows = store.type_rows.get(code, ()) if code is not None else ()
+            return [SceneObject.view(store, row) for row in rows]
+        return list(self.iter_all(type_name))
 
     def __str__(self, indent: int = 0) -> str:
         pad = "  " * indent
@@ -92,6 +394,24 @@ def extract_object_types(tree: Tree):
         types.append(ObjectType(type_name, attributes, children))
     return types
 
+def extract_scenes(tree: Tree):
+    scenes = []
+    for stmt in tree.find_data("scene_check"):
+        scene_name = stmt.children[0].value
+        folder_path = stmt.children[1].value.strip('"')
+        root_type = stmt.children[2].value
+        scenes.append({"name": scene_name, "path": folder_path, "root_type": root_type})
+    return scenes
+
+def extract_method_calls(tree: Tree):
+    methods = []
+    for stmt in tree.find_data("method_call"):
+        caller = stmt.children[0].value
+        start, end = stmt.children[1].value, stmt.children[2].value
+        rules = [c.value for c in stmt.children[3:] if isinstance(c, Token)]
+        methods.append({"caller": caller, "start": start, "end": end, "rules": rules})
+    return methods
+
 def make_hierarchy(root_type_name, type_map, image=None):
     tdef = type_map[root_type_name]
     obj = SceneObject(tdef.name, "",source_image=image)
@@ -0,0 +1,248 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from PIL import Image as PILImage
+from lark import Tree
+from Core.SceneObject import extract_object_types, extract_scenes, extract_method_calls, make_hierarchy
+from Core.RuleCompiler import compile_rules, run_rule
+from Core.RuleAnalysis import RuleRequirements, order_by_cost, ruleset_requirements
+from Core.VectorEval import VectorRule, check_batch, lower_rules
+from Core.ResultsWriter import ResultsWriter, completed_scenes
+from Core.Checkpoint import Checkpoint, ruleset_hash
+from models.Query import (configure_detection_cache, configure_result_store, get_model_registry, load_model_registry,
+                          model_versions, prefetch_detections)
+from models.Profiler import PROFILER, rule_name
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def list_scene_images(folder: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+    """Image files of a LoadScene folder in name order, sliced like Check(start, end, ...)."""
+    return [path for _, path in index_scene_images(folder, start, end)]
+
+
+def index_scene_images(folder: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, str]]:
+    """(position in the folder, path) of the images list_scene_images returns; negative bounds count from the end."""
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTENSIONS))
+    return [(index, os.path.join(folder, names[index])) for index in range(len(names))[start:end]]
+
+
+def load_image(path: str) -> PILImage.Image:
+    with PROFILER.span("load_image"):
+        return PILImage.open(path).convert("RGB")
+
+
+def check_scene(rules: List[Callable], root, stop_after: Optional[int] = None) -> List[str]:
+    """Contradictions of root in rule order; with stop_after, no further rule runs once that many are found.
+
+    Compiled rules share one memo for the scene, so a path or count several rules read is computed once.
+    """
+    results = []
+    memo = {}
+    for rule in rules:
+        if stop_after is not None and len(results) >= stop_after:
+            break
+        if PROFILER.enabled:
+            with PROFILER.span(f"rule:{rule_name(rule)}"):
+                result = run_rule(rule, root, memo)
+        else:
+            result = run_rule(rule, root, memo)
+        if result:
+            results.append(result)
+    return results
+
+
+def resolve_bound(value: str, bindings: Dict[str, Optional[int]]) -> Optional[int]:
+    """Turn a Check() start/end argument (a NUMBER or a bound name) into a slice index."""
+    if value in bindings:
+        return bindings[value]
+    if value.lstrip("-").isdigit():
+        return int(value)
+    if value == "start":
+        return 0
+    if value == "end":
+        return None
+    try:
+        float(value)
+    except ValueError:
+        raise ValueError(f"Unbound Check() argument: {value}") from None
+    raise ValueError(f"Check() bound must be an integer: {value}")
+
+
+# Per-process state, filled in by _init_worker (or directly when running inline).
+_WORKER: Dict[str, object] = {}
+
+
+def _init_worker(type_map, root_type: str, rules: List[Callable], torch_threads: Optional[int], batch_size: int,
+                 model_names: Optional[List[str]] = None, store_path: Optional[str] = None,
+                 stop_after: Optional[int] = None):
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    configure_detection_cache(max_entries=max(2 * batch_size, 4))
+    # Every worker opens its own connection; SQLite in WAL mode handles the concurrent writers.
+    if store_path:
+        configure_result_store(store_path)
+    _WORKER.update(type_map=type_map, root_type=root_type, rules=rules, batch_size=batch_size,
+                   model_names=model_names, stop_after=stop_after)
+    if model_names is None:
+        load_model_registry()
+    else:
+        get_model_registry().preload(model_names)
+
+
+def _check_chunk(paths: List[str]) -> List[List[str]]:
+    images = []
+    for path in paths:
+        with PROFILER.scene(path):
+            images.append(load_image(path))
+    prefetch_detections(images, get_model_registry(), _WORKER["batch_size"], _WORKER.get("model_names"))
+    roots = [make_hierarchy(_WORKER["root_type"], _WORKER["type_map"], image) for image in images]
+    if all(isinstance(rule, VectorRule) for rule in _WORKER["rules"]):
+        return check_batch(_WORKER["rules"], roots, _WORKER.get("stop_after"))
+    results = []
+    for path, root in zip(paths, roots):
+        with PROFILER.scene(path):
+            results.append(check_scene(_WORKER["rules"], root, _WORKER.get("stop_after")))
+    return results
+
+
+def run_check(paths: List[str], type_map, root_type: str, rules: List[Callable], workers: Optional[int] = None,
+              torch_threads: Optional[int] = 1, batch_size: int = 1, mp_context=None,
+              model_names: Optional[List[str]] = None, store_path: Optional[str] = None,
+              stage_workers: Optional[Dict[str, int]] = None, queue_size: int = 4,
+              requirements: Optional[RuleRequirements] = None,
+              stop_after: Optional[int] = None) -> Iterator[Tuple[str, List[str]]]:
+    """Check every image against rules, fanned out over a process pool; yields (path, contradictions) in order.
+
+    rules must be picklable (module-level functions) when workers > 1. Each worker loads the models
+    once and is pinned to torch_threads intra-op threads, so the pool should be sized to roughly
+    cores / torch_threads. workers <= 1 runs inline in this process.
+    model_names, when known, limits which models are preloaded and which segmentors are prefetched.
+    store_path names a SQLite result store; images already in it skip inference entirely.
+    stage_workers selects the threaded decode/detect/classify/rules pipeline in this process instead
+    of the pool (see Core.Pipeline), with that many threads per stage and queue_size chunks between
+    stages; it can't be combined with workers > 1.
+    stop_after ends a scene's check once that many rules have reported a contradiction (1: first only).
+    """
+    if stage_workers is not None:
+        if workers is not None and workers > 1:
+            raise ValueError("stage_workers runs the threaded pipeline in this process; it can't use workers > 1")
+        if torch_threads:
+            import torch
+            torch.set_num_threads(torch_threads)
+        if store_path:
+            configure_result_store(store_path)
+        # Imported here: the pipeline module builds on this one.
+        from Core.Pipeline import check_pipeline
+        yield from check_pipeline(paths, type_map, root_type, rules, batch_size, stage_workers, queue_size,
+                                  model_names, requirements, stop_after)
+        return
+
+    chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    workers = workers if workers is not None else max(1, (os.cpu_count() or 1) // max(torch_threads or 1, 1))
+    if workers <= 1:
+        if store_path:
+            configure_result_store(store_path)
+        _WORKER.update(type_map=type_map, root_type=root_type, rules=rules, batch_size=batch_size,
+                       model_names=model_names, stop_after=stop_after)
+        for chunk in chunks:
+            yield from zip(chunk, _check_chunk(chunk))
+        return
+
+    if isinstance(mp_context, str):
+        mp_context = multiprocessing.get_context(mp_context)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(type_map, root_type, rules, torch_threads, batch_size, model_names,
+                                       store_path, stop_after)) as pool:
+        for chunk, results in zip(chunks, pool.map(_check_chunk, chunks)):
+            yield from zip(chunk, results)
+
+
+def _save_checkpoint(progress: Checkpoint, writer: Optional[ResultsWriter]) -> None:
+    # Results first: the checkpoint must never claim an image whose record could still be lost.
+    if writer is not None:
+        writer.flush()
+    progress.save()
+
+
+def run_program(tree: Tree, rules: Optional[Dict[str, Callable]] = None,
+                bindings: Optional[Dict[str, Optional[int]]] = None, engine: str = "compiled",
+                writer: Optional[ResultsWriter] = None, checkpoint: Optional[str] = None,
+                checkpoint_every: int = 100, **options) -> Iterator[dict]:
+    """Execute every `scene.Check(start, end, [rules])` statement of a parsed DSL program.
+
+    The program's rule_defs are compiled once; rules may add or override callables by name.
+    engine="vector" lowers them to NumPy column operations instead, evaluated per image batch.
+    Results stream back as one record per image, in folder order; with a writer each record is
+    also appended to the results file as soon as its image is checked.
+
+    With a checkpoint path, progress (last completed image per Check() call, ruleset hash and
+    model weight hashes) is saved every checkpoint_every images, after the writer is flushed.
+    A rerun with the same rules, stop_after and weights resumes after the last completed image and
+    also skips images the results file already holds for them; skipped images are not yielded.
+
+    With stop_after (e.g. 1 for "first contradiction"), each call's rules run cheapest first, by
+    the models their fields need (RuleAnalysis.order_by_cost), and a scene stops being checked
+    once stop_after contradictions are found; contradictions are then listed in that order.
+    """
+    type_map = {t.name: t for t in extract_object_types(tree)}
+    scenes = {scene["name"]: scene for scene in extract_scenes(tree)}
+    bindings = bindings or {}
+    rule_trees = {stmt.children[0].value: stmt for stmt in tree.find_data("rule_def")}
+    custom = set(rules or {})
+    if engine not in ("compiled", "vector"):
+        raise ValueError(f"Unknown rule engine: {engine}")
+    program_rules = lower_rules(tree) if engine == "vector" else compile_rules(tree)
+    rules = {**program_rules, **(rules or {})}
+    fingerprints = {name: getattr(rule, "fingerprint", None) for name, rule in rules.items()}
+    stop_after = options.get("stop_after")
+    done = set()
+    if writer is not None:
+        if checkpoint is not None and writer.has_header:
+            done = completed_scenes(writer.path, fingerprints, stop_after)
+        writer.write_header({"rules": fingerprints, "stop_after": stop_after})
+    progress = Checkpoint(checkpoint, ruleset_hash(fingerprints, stop_after), model_versions()) if checkpoint else None
+
+    for position, call in enumerate(extract_method_calls(tree)):
+        scene = scenes.get(call["caller"])
+        if scene is None:
+            raise ValueError(f"Check() on undefined scene: {call['caller']}")
+        missing = [name for name in call["rules"] if name not in rules]
+        if missing:
+            raise ValueError(f"Unknown rule(s) in {call['caller']}.Check: {', '.join(missing)}")
+        start = resolve_bound(call["start"], bindings)
+        end = resolve_bound(call["end"], bindings)
+        call_key = f"{position}:{call['caller']}"
+        first = progress.next_index(call_key, 0) if progress else 0
+        pending = [
+            (index, path) for index, path in index_scene_images(scene["path"], start, end)
+            if index >= first and (scene["name"], path) not in done
+        ]
+        # Models are only preloaded when every rule in the call is a DSL rule we can analyse.
+        model_names, requirements = None, None
+        if not custom.intersection(call["rules"]):
+            requirements = ruleset_requirements([rule_trees[name] for name in call["rules"]], type_map,
+                                                get_model_registry())
+            model_names = requirements.models()
+        names = call["rules"]
+        if stop_after is not None:
+            names = order_by_cost(names, {name: rule_trees[name] for name in names if name not in custom}, type_map,
+                                  registry=get_model_registry())
+        checked = run_check([path for _, path in pending], type_map, scene["root_type"],
+                            [rules[name] for name in names], model_names=model_names,
+                            requirements=requirements, **options)
+        for count, ((index, path), (_, contradictions)) in enumerate(zip(pending, checked), start=1):
+            record = {"scene": scene["name"], "index": index, "image": path, "contradictions": contradictions}
+            if writer is not None:
+                writer.write(record)
+            if progress is not None:
+                progress.mark(call_key, index)
+                if count % checkpoint_every == 0 or count == len(pending):
+                    _save_checkpoint(progress, writer)
+            yield record
@@ -0,0 +1,185 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+UNSET = -1
+
+
+class Column:
+    """One categorical attribute over every row of a store: int32 codes into a table of distinct values.
+
+    Values that can't be hashed (lists, dicts) are not coded against the others; each gets a category of its own.
+    """
+    __slots__ = ("codes", "categories", "_index")
+
+    def __init__(self):
+        self.codes = array("i")
+        self.categories: list = []
+        self._index: Dict[object, int] = {}
+
+    def encode(self, value) -> int:
+        if value is None:
+            return UNSET
+        try:
+            code = self._index.get(value)
+        except TypeError:
+            self.categories.append(value)
+            return len(self.categories) - 1
+        if code is None:
+            code = self._index[value] = len(self.categories)
+            self.categories.append(sys.intern(value) if isinstance(value, str) else value)
+        return code
+
+    def get(self, row: int):
+        code = self.codes[row] if row < len(self.codes) else UNSET
+        return None if code == UNSET else self.categories[code]
+
+    def set(self, row: int, value) -> None:
+        if row >= len(self.codes):
+            self.codes.extend(array("i", [UNSET]) * (row + 1 - len(self.codes)))
+        self.codes[row] = self.encode(value)
+
+    def has(self, row: int) -> bool:
+        return row < len(self.codes) and self.codes[row] != UNSET
+
+
+class SceneStore:
+    """Columnar storage for one scene hierarchy; SceneObject instances are (store, row) views onto it.
+
+    Every object is a row in parallel typed arrays (type id, parent row, box, score) plus one
+    categorical Column per attribute name. Child lists are int32 row arrays keyed by (parent, key).
+    Type and attribute names are interned, and the registry and image are held once per scene
+    instead of once per object.
+    """
+    __slots__ = ("model_registry", "replayed", "type_names", "_type_codes", "type_ids", "parents", "boxes",
+                 "scores", "sources", "columns", "declared", "children", "child_keys", "queried", "type_rows",
+                 "detached", "moved")
+
+    def __init__(self, model_registry=None):
+        self.model_registry = model_registry
+        self.replayed = False
+        self.type_names: List[str] = []
+        self._type_codes: Dict[str, int] = {}
+        self.type_ids = array("i")
+        self.parents = array("i")
+        self.boxes = array("i")
+        self.scores = array("f")
+        # Root image or Detection per row; only these need pixels, so nothing is copied.
+        self.sources: list = []
+        self.columns: Dict[str, Column] = {}
+        # type id -> (declared attribute names, declared child keys), filled by SceneObject.setup.
+        self.declared: Dict[int, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+        self.children: Dict[Tuple[int, str], array] = {}
+        self.child_keys: Dict[int, List[str]] = {}
+        # row -> keys a model was asked about; a missing children entry then means "none found".
+        self.queried: Dict[int, Set[str]] = {}
+        # type id -> rows of that type, in creation order; find_all on the root reads it directly.
+        self.type_rows: Dict[int, array] = {}
+        # Set once a child list is replaced and some rows fall out of the tree, which the index can't tell.
+        self.detached = False
+        # (new store, old row -> new row) once this store's tree has been moved into another one.
+        self.moved: Optional[Tuple["SceneStore", array]] = None
+
+    def __len__(self) -> int:
+        return len(self.type_ids)
+
+    def type_code(self, name: str) -> int:
+        code = self._type_codes.get(name)
+        if code is None:
+            code = self._type_codes[name] = len(self.type_names)
+            self.type_names.append(sys.intern(name))
+        return code
+
+    def add(self, type_name: str, source=None, parent: int = UNSET, key: Optional[str] = None) -> int:
+        row = len(self.type_ids)
+        code = self.type_code(type_name)
+        self.type_ids.append(code)
+        rows = self.type_rows.get(code)
+        if rows is None:
+            rows = self.type_rows[code] = array("i")
+        rows.append(row)
+        self.parents.append(parent)
+        box = getattr(source, "box", None)
+        self.boxes.extend(box if box is not None else (0, 0, 0, 0))
+        score = getattr(source, "score", None)
+        self.scores.append(float("nan") if score is None else score)
+        self.sources.append(source)
+        if key is not None:
+            self._group(parent, key).append(row)
+        return row
+
+    def _group(self, row: int, key: str) -> array:
+        group = self.children.get((row, key))
+        if group is None:
+            key = sys.intern(key)
+            group = self.children[(row, key)] = array("i")
+            self.child_keys.setdefault(row, []).append(key)
+        return group
+
+    def set_children(self, row: int, key: str, rows: List[int]) -> None:
+        group = self._group(row, key)
+        if group and not self.detached:
+            self.detached = bool(set(group) - set(rows))
+        del group[:]
+        group.extend(rows)
+        for child in rows:
+            self.parents[child] = row
+
+    def mark_queried(self, row: int, keys: Iterable[str]) -> None:
+        self.queried.setdefault(row, set()).update(keys)
+
+    def was_queried(self, row: int, key: str) -> bool:
+        return key in self.queried.get(row, ())
+
+    def queried_keys(self, row: int) -> Set[str]:
+        return self.queried.get(row, set())
+
+    def type_name(self, row: int) -> str:
+        return self.type_names[self.type_ids[row]]
+
+    def declare(self, row: int, attributes: List[str], child_keys: List[str]) -> None:
+        self.declared[self.type_ids[row]] = (tuple(sys.intern(a) for a in attributes),
+                                             tuple(sys.intern(k) for k in child_keys))
+
+    def column(self, key: str) -> Column:
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[sys.intern(key)] = Column()
+        return column
+
+    def attribute(self, row: int, key: str):
+        column = self.columns.get(key)
+        return column.get(row) if column is not None else None
+
+    def set_attribute(self, row: int, key: str, value) -> None:
+        self.column(key).set(row, value)
+
+    def attribute_keys(self, row: int) -> List[str]:
+        keys = list(self.declared.get(self.type_ids[row], ((), ()))[0])
+        keys += [key for key, column in self.columns.items() if key not in keys and column.has(row)]
+        return keys
+
+    def object_keys(self, row: int) -> List[str]:
+        keys = list(self.declared.get(self.type_ids[row], ((), ()))[1])
+        keys += [key for key in self.child_keys.get(row, ()) if key not in keys]
+        return keys
+
+    def child_rows(self, row: int, key: str) -> Optional[array]:
+        return self.children.get((row, key))
+
+    def iter_rows(self, row: int) -> Iterator[int]:
+        """row and every row below it, depth first."""
+        stack = [row]
+        while stack:
+            current = stack.pop()
+            yield current
+            for key in reversed(self.child_keys.get(current, ())):
+                stack.extend(reversed(self.children[(current, key)]))
+
+    def nbytes(self) -> int:
+        """Approximate size of the columns (not the images or detections they point at)."""
+        total = sum(a.itemsize * len(a) for a in (self.type_ids, self.parents, self.boxes, self.scores))
+        total += sum(c.codes.itemsize * len(c.codes) for c in self.columns.values())
+        total += sum(g.itemsize * len(g) for g in self.children.values())
+        total += sum(r.itemsize * len(r) for r in self.type_rows.values())
+        return total + 8 * len(self.sources)
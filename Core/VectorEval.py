@@ -0,0 +1,325 @@
+import operator
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from lark import Tree
+from Core.RuleCompiler import _literal, _num, rule_fingerprint
+from Core.SceneObject import SceneObject, SnapshotMiss
+from Core.SceneStore import UNSET, SceneStore
+from models.Query import is_attribute_key, query_batch
+from models.Profiler import PROFILER
+
+OPS = {"=": operator.eq, "!=": operator.ne, ">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le}
+
+
+# === Lowering ===
+class VectorRule:
+    """A DSL rule lowered to column operations, evaluated over a whole batch of scenes at once.
+
+    statements holds one (loop_var, child_key, [(condition, code), ...]) per for_stmt / if_stmt;
+    loop_var and child_key are None for top-level ifs. Calling it on a single scene gives the
+    same result as the CompiledRule for that rule.
+    """
+    __slots__ = ("name", "fingerprint", "param", "statements")
+
+    def __init__(self, name: str, fingerprint: str, param: str, statements: list):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.param = param
+        self.statements = statements
+
+    def __call__(self, scene: SceneObject) -> Optional[str]:
+        return evaluate_rules([self], [scene])[0][0]
+
+    def __getstate__(self):
+        return self.name, self.fingerprint, self.param, self.statements
+
+    def __setstate__(self, state):
+        self.name, self.fingerprint, self.param, self.statements = state
+
+    def __repr__(self):
+        return f"<VectorRule {self.name} {self.fingerprint[:12]}>"
+
+
+def _lower_condition(condition: Tree) -> tuple:
+    node = condition.children[0] if condition.data == "condition" else condition
+    if node.data == "count_condition":
+        parts = tuple(t.value for t in node.children[0].children)
+        return ("count", parts[0], parts[1:], node.children[1].value, _literal(node.children[2]))
+    if node.data == "expr":
+        return ("expr", node.children[0].value, node.children[1].value, node.children[2].value,
+                _literal(node.children[3]))
+    raise ValueError(f"Unsupported condition: {node.data}")
+
+
+def _lower_if(if_stmt: Tree) -> Tuple[tuple, str]:
+    condition = next(c for c in if_stmt.children if isinstance(c, Tree) and c.data != "contradiction")
+    code = next(c for c in if_stmt.children if isinstance(c, Tree) and c.data == "contradiction").children[0].value
+    return _lower_condition(condition), f"contradiction {code}"
+
+
+def lower_rule(rule_tree: Tree) -> VectorRule:
+    name, param = rule_tree.children[0].value, rule_tree.children[1].value
+    statements = []
+    for node in rule_tree.children[3].children:
+        if not isinstance(node, Tree):
+            continue
+        if node.data == "for_stmt":
+            var, _, child = (t.value for t in node.children[:3])
+            statements.append((var, child, [_lower_if(if_stmt) for if_stmt in node.children[3:]]))
+        elif node.data == "if_stmt":
+            statements.append((None, None, [_lower_if(node)]))
+    return VectorRule(name, rule_fingerprint(rule_tree), param, statements)
+
+
+def lower_rules(tree: Tree) -> Dict[str, VectorRule]:
+    return {stmt.children[0].value: lower_rule(stmt) for stmt in tree.find_data("rule_def")}
+
+
+def _predicate(op: str, value):
+    """Python-side comparison of one attribute value, with the generated rules' semantics."""
+    compare = OPS[op]
+    if isinstance(value, str):
+        if op in ("=", "!="):
+            return lambda v: compare(v, value)
+        return lambda v: compare(v or "", value)
+    return lambda v: compare(_num(v), value)
+
+
+# === Evaluation ===
+def _local_codes(store: SceneStore, column) -> np.ndarray:
+    codes = np.array(column.codes, dtype=np.int64)
+    if len(codes) < len(store):
+        codes = np.concatenate([codes, np.full(len(store) - len(codes), UNSET, dtype=np.int64)])
+    return codes
+
+
+class Frame:
+    """A flat set of objects across the batch: scene index and store row per element, in scene order."""
+    __slots__ = ("scene", "row")
+
+    def __init__(self, scene: np.ndarray, row: np.ndarray):
+        self.scene = scene
+        self.row = row
+
+    def __len__(self) -> int:
+        return len(self.row)
+
+    def by_scene(self):
+        """(scene index, element slice) for every scene present; elements are grouped by scene."""
+        scenes, starts = np.unique(self.scene, return_index=True)
+        ends = np.append(starts[1:], len(self.scene))
+        return [(int(s), slice(int(a), int(b))) for s, a, b in zip(scenes, starts, ends)]
+
+
+class SceneBatch:
+    """Attribute columns of several scene stores under one shared code space per attribute."""
+
+    def __init__(self, roots: Sequence[SceneObject]):
+        self.stores: List[SceneStore] = [root.store for root in roots]
+        self.root = Frame(np.arange(len(roots)), np.array([root.row for root in roots], dtype=np.int64))
+        self.categories: Dict[str, list] = {}
+        self._category_index: Dict[str, dict] = {}
+        self._declared = {attr for store in self.stores for attrs, _ in store.declared.values() for attr in attrs}
+        self._registries = list({id(store.model_registry): store.model_registry for store in self.stores}.values())
+        # (id of source frame, object path) -> (frame reached, source element of each), shared by all rules.
+        # Every source frame is the root or a cached path frame, so the ids stay valid for the batch.
+        self._paths: Dict[Tuple[int, Tuple[str, ...]], Tuple[Frame, np.ndarray]] = {}
+        self._counts: Dict[Tuple[int, Tuple[str, ...]], np.ndarray] = {}
+        self._kinds: Dict[str, bool] = {}
+        self._flat: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def is_attribute(self, key: str) -> bool:
+        if key not in self._kinds:
+            self._kinds[key] = (any(is_attribute_key(key, registry) for registry in self._registries)
+                                or key in self._declared
+                                or any(key in store.columns for store in self.stores))
+        return self._kinds[key]
+
+    def children(self, frame: Frame, key: str) -> Tuple[Frame, np.ndarray]:
+        """Child objects under key of every element, and the element each child came from."""
+        rows, sizes = [], []
+        stores = self.stores
+        for scene, row in zip(frame.scene.tolist(), frame.row.tolist()):
+            store = stores[scene]
+            group = store.children.get((row, key))
+            if not store.was_queried(row, key):
+                # Same lookup (and model query) the generated rules would do; sourceless rows yield nothing.
+                value = SceneObject.view(store, row).get(key)
+                group = store.children.get((row, key)) if isinstance(value, list) else None
+                self._flat.clear()
+            if group:
+                rows.extend(group)
+                sizes.append(len(group))
+            else:
+                sizes.append(0)
+        owner = np.repeat(np.arange(len(frame)), sizes)
+        return Frame(frame.scene[owner], np.array(rows, dtype=np.int64)), owner
+
+    def _flat_codes(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Batch-wide codes of key for every row of every store, and each store's offset into them."""
+        cached = self._flat.get(key)
+        if cached is not None:
+            return cached
+        index = self._category_index.setdefault(key, {})
+        categories = self.categories.setdefault(key, [])
+        parts = []
+        for store in self.stores:
+            column = store.columns.get(key)
+            if column is None:
+                parts.append(np.full(len(store), UNSET, dtype=np.int64))
+                continue
+            remap = []
+            for value in column.categories:
+                try:
+                    code = index.get(value)
+                    if code is None:
+                        code = index[value] = len(categories)
+                        categories.append(value)
+                except TypeError:
+                    # Unhashable values are uncoded in the column as well; each keeps a category of its own.
+                    code = len(categories)
+                    categories.append(value)
+                remap.append(code)
+            # The trailing UNSET entry makes local code -1 map to UNSET again.
+            remap = np.array(remap + [UNSET], dtype=np.int64)
+            parts.append(remap[_local_codes(store, column)])
+        sizes = [len(part) for part in parts]
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        cached = self._flat[key] = (np.concatenate(parts) if parts else np.empty(0, dtype=np.int64), offsets)
+        return cached
+
+    def codes(self, frame: Frame, key: str) -> np.ndarray:
+        """Batch-wide category codes of attribute key for every element (UNSET where there is none)."""
+        flat, offsets = self._flat_codes(key)
+        codes = flat[offsets[frame.scene] + frame.row]
+        missing = codes == UNSET
+        if missing.any():
+            pending = Frame(frame.scene[missing], frame.row[missing])
+            resolved = [self._ensure(self.stores[scene], pending.row[part], key) for scene, part in pending.by_scene()]
+            if any(resolved):
+                del self._flat[key]
+                flat, offsets = self._flat_codes(key)
+                codes = flat[offsets[frame.scene] + frame.row]
+        return codes
+
+    def _ensure(self, store: SceneStore, missing: np.ndarray, key: str) -> bool:
+        """Resolve key, in one model batch, for the rows SceneObject.get would resolve it for."""
+        if store.replayed:
+            raise SnapshotMiss(key)
+        classifier = is_attribute_key(key, store.model_registry)
+        pending = [
+            row for row in missing.tolist()
+            if store.sources[row] is not None
+            and (classifier or key in store.declared.get(store.type_ids[row], ((), ()))[0])
+        ]
+        if not pending:
+            return False
+        results = query_batch([store.sources[row] for row in pending], key, store.model_registry)
+        for row, result in zip(pending, results):
+            store.set_attribute(row, key, result)
+        return True
+
+    def path_frame(self, frame: Frame, path: Tuple[str, ...]) -> Tuple[Frame, np.ndarray]:
+        """Objects reached from frame along an object-key path, and the element of frame each came from."""
+        if not path:
+            return frame, np.arange(len(frame))
+        token = (id(frame), path)
+        cached = self._paths.get(token)
+        if cached is None:
+            parent, owner = self.path_frame(frame, path[:-1])
+            child, child_owner = self.children(parent, path[-1])
+            cached = self._paths[token] = (child, owner[child_owner])
+        return cached
+
+    def count(self, frame: Frame, path: Tuple[str, ...]) -> np.ndarray:
+        token = (id(frame), path)
+        counts = self._counts.get(token)
+        if counts is not None:
+            return counts
+        # Everything up to the first attribute is an object path; anything after an attribute is ignored.
+        split = next((i for i, part in enumerate(path) if self.is_attribute(part)), len(path))
+        current, owner = self.path_frame(frame, path[:split])
+        if split < len(path):
+            owner = owner[self.codes(current, path[split]) != UNSET]
+        counts = self._counts[token] = np.bincount(owner, minlength=len(frame))
+        return counts
+
+    def compare(self, frame: Frame, key: str, op: str, value) -> np.ndarray:
+        codes = self.codes(frame, key)
+        predicate = _predicate(op, value)
+        table = np.array([predicate(c) for c in self.categories[key]] + [predicate(None)], dtype=bool)
+        return table[codes]
+
+    def loop_frame(self, key: str) -> Frame:
+        return self.path_frame(self.root, (key,))[0]
+
+
+def _condition_mask(batch: SceneBatch, rule: VectorRule, condition: tuple, loop_var: Optional[str],
+                    frame: Frame) -> np.ndarray:
+    kind, var = condition[0], condition[1]
+    on_loop = loop_var is not None and var == loop_var
+    source = frame if on_loop else batch.root
+    if kind == "count":
+        _, _, path, op, value = condition
+        counts = batch.count(source, path)
+        mask = OPS[op](counts, _num(value) if isinstance(value, str) else value)
+    else:
+        _, _, key, op, value = condition
+        mask = batch.compare(source, key, op, value)
+    # Conditions on the rule parameter inside a for loop hold for every element of that scene.
+    return mask if on_loop or frame is batch.root else mask[frame.scene]
+
+
+def evaluate_rules(rules: Sequence[VectorRule], roots: Sequence[SceneObject],
+                   stop_after: Optional[int] = None) -> List[List[Optional[str]]]:
+    """Result of every rule on every scene: results[scene][rule] is 'contradiction N' or None.
+
+    Unlike the generated Python, every condition is evaluated for every scene, so models are
+    queried for all keys a rule mentions even when an earlier statement already fired.
+    With stop_after, scenes that already have that many contradictions are left out of the
+    remaining rules (their results stay None).
+    """
+    batch = SceneBatch(roots)
+    results = [[None] * len(rules) for _ in roots]
+    active = list(range(len(roots)))
+    found = [0] * len(roots)
+    for k, rule in enumerate(rules):
+        if not active:
+            break
+        with PROFILER.span(f"rule:{rule.name}", scenes=len(active)):
+            # The rows are shared lists, so filling the subset fills results.
+            _evaluate_rule(batch, rule, k, [results[i] for i in active])
+        if stop_after is not None:
+            for i in active:
+                found[i] += results[i][k] is not None
+            remaining = [i for i in active if found[i] < stop_after]
+            if len(remaining) < len(active):
+                active = remaining
+                batch = SceneBatch([roots[i] for i in active])
+    return results
+
+
+def _evaluate_rule(batch: SceneBatch, rule: VectorRule, k: int, results: List[List[Optional[str]]]) -> None:
+    """Fill column k of results with rule's result on every scene of the batch."""
+    open_scenes = np.ones(len(results), dtype=bool)
+    for loop_var, child, branches in rule.statements:
+        frame = batch.loop_frame(child) if loop_var is not None else batch.root
+        masks = np.array([_condition_mask(batch, rule, condition, loop_var, frame) for condition, _ in branches],
+                         dtype=bool).reshape(len(branches), len(frame))
+        hits = np.nonzero(masks.any(axis=0))[0]
+        # First firing element per scene, then the first if that fired for it.
+        scenes, first = np.unique(frame.scene[hits], return_index=True)
+        elements = hits[first]
+        branch = masks[:, elements].argmax(axis=0)
+        for scene, b in zip(scenes.tolist(), branch.tolist()):
+            if open_scenes[scene]:
+                results[scene][k] = branches[b][1]
+                open_scenes[scene] = False
+        if not open_scenes.any():
+            break
+
+
+def check_batch(rules: Sequence[VectorRule], roots: Sequence[SceneObject],
+                stop_after: Optional[int] = None) -> List[List[str]]:
+    """Contradictions per scene in rule order, like SceneRunner.check_scene for each root."""
+    return [[r for r in row if r] for row in evaluate_rules(rules, roots, stop_after)]
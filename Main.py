@@ -1,16 +1,10 @@
-from lark import Lark
 from collections import defaultdict
 from PIL import Image as PILImage
 from Core.SceneObject import extract_object_types, make_hierarchy
+from Core.Grammar import get_parser
 from typing import Union
 
 
-def get_parser():
-    with open('grammar.lark', 'r') as f:
-        grammar_text = f.read()
-    return Lark(grammar_text, start="start", parser="lalr")
-
-
 
 def FindContradictions(rules, root):
     for rule in rules:
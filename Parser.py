@@ -43,6 +43,9 @@ class SceneObject:
         self.type = type_name
         self.attributes = {}
         self.ObjectList = {}
+        # Type name -> objects of that type in the whole hierarchy; only the root keeps one.
+        self.root = self
+        self.type_index = {type_name: [self]}
 
     def setup(self, obj_type):
         for attr in obj_type.attributes:
@@ -61,15 +64,27 @@ class SceneObject:
         if obj.type not in self.ObjectList:
             self.ObjectList[obj.type] = []
         self.ObjectList[obj.type].append(obj)
+        if obj.type_index is not None:
+            root = self.root
+            for type_name, objs in obj.type_index.items():
+                root.type_index.setdefault(type_name, []).extend(objs)
+                for o in objs:
+                    o.root = root
+                    o.type_index = None
+
+    def iter_all(self, type_name):
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            if obj.type == type_name:
+                yield obj
+            for lst in reversed(list(obj.ObjectList.values())):
+                stack.extend(reversed(lst))
 
     def find_all(self, type_name):
-        results = []
-        if self.type == type_name:
-            results.append(self)
-        for lst in self.ObjectList.values():
-            for child in lst:
-                results.extend(child.find_all(type_name))
-        return results
+        if self.type_index is not None:
+            return list(self.type_index.get(type_name, ()))
+        return list(self.iter_all(type_name))
 
     def __str__(self, indent=0):
         pad = "  " * indent
@@ -114,43 +129,13 @@ def extract_method_calls(tree):
     methods = []
     for stmt in tree.find_data("method_call"):
         caller = stmt.children[0].value
+        start, end = stmt.children[1].value, stmt.children[2].value
         rules = [c.value for c in stmt.children[3:] if isinstance(c, Token)]
-        methods.append({"caller": caller, "rules": rules})
+        methods.append({"caller": caller, "start": start, "end": end, "rules": rules})
     return methods
 
 if __name__ == "__main__":
-    from lark import Lark
-
-    grammar = """
-    start: statement+
-    statement: type_def | rule_def | scene_check | method_call
-    type_def: "type" IDENT "{" type_body "}"
-    type_body: attr_block obj_block
-    attr_block: "attributes:" "[" attr_list? "]"
-    attr_list: IDENT ("," IDENT)*
-    obj_block: "objects:" "[" obj_list? "]"
-    obj_list: obj_item ("," obj_item)*
-    obj_item: IDENT multiplicity?
-    multiplicity: "+" | "*" | "?"
-    rule_def: "rule" IDENT "(" IDENT ":" IDENT ")" "{" rule_body "}"
-    rule_body: (for_stmt | if_stmt)+
-    for_stmt: "for" IDENT "in" IDENT "." IDENT "do" "{" if_stmt+ "}"
-    if_stmt: "if" condition "then" "{" contradiction "}"
-    condition: count_condition | expr
-    count_condition: "count" "(" field ")" COMPARE value
-    expr: IDENT "." IDENT COMPARE value
-    field: IDENT ("." IDENT)*
-    COMPARE: "=" | ">" | "<" | ">=" | "<=" | "!="
-    value: STRING | NUMBER
-    contradiction: "contradiction" NUMBER
-    scene_check: IDENT "=" "LoadScene" "(" STRING "," IDENT ")"
-    method_call: IDENT ".Check(" IDENT "," IDENT "," "[" IDENT ("," IDENT)* "]" ")"
-    %import common.CNAME -> IDENT
-    %import common.ESCAPED_STRING -> STRING
-    %import common.NUMBER
-    %import common.WS
-    %ignore WS
-    """
+    from Core.Grammar import get_parser
 
     example_dsl = """
     type Object1 {
@@ -181,7 +166,7 @@ if __name__ == "__main__":
     scene1.Check(start, end, [ShapeCountLimit, SphereTorusVsCubes])
     """
 
-    parser = Lark(grammar, start="start", parser="lalr")
+    parser = get_parser()
     tree = parser.parse(example_dsl)
 
     print("=== DSL PARSE TREE ===")
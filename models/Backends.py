@@ -0,0 +1,161 @@
+import copy
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import torch
+
+BACKENDS = ("eager", "torchscript", "onnx")
+
+
+def backend_tag(backend: str = "eager", quantize: bool = False, channels_last: bool = False, **_) -> str:
+    """Short label of an inference configuration; empty for plain eager, so existing result stores stay valid."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    parts = [] if backend == "eager" else [backend]
+    if quantize:
+        parts.append("int8")
+    if channels_last:
+        parts.append("cl")
+    return "+".join(parts)
+
+
+def preprocess_tag(max_side: Optional[int] = None, tile: Optional[int] = None, overlap: int = 128, **_) -> str:
+    """Short label of a segmentor resize / tiling policy; empty when frames go in at full size."""
+    parts = []
+    if max_side:
+        parts.append(f"max{max_side}")
+    if tile:
+        parts.append(f"tile{tile}o{overlap}")
+    return "-".join(parts)
+
+
+def version_suffix(*tags: str) -> str:
+    """Joined non-empty configuration tags, appended to a weights hash wherever results are cached."""
+    joined = "+".join(tag for tag in tags if tag)
+    return f"+{joined}" if joined else ""
+
+
+def quantize_linear(module: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of the Linear layers (weights int8, activations quantized per batch); CPU only."""
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def channels_last_copy(module: torch.nn.Module) -> torch.nn.Module:
+    """Copy of module with NHWC conv weights; the original stays as it was, for falling back to."""
+    return copy.deepcopy(module).to(memory_format=torch.channels_last)
+
+
+def channels_last_input(module: torch.nn.Module, inputs: Tuple[torch.Tensor]) -> Tuple[torch.Tensor]:
+    """Forward pre-hook handing a module its input in NHWC; typed so TorchScript can script it."""
+    return (inputs[0].contiguous(memory_format=torch.channels_last),)
+
+
+def set_threads(backend: str, threads: Optional[int]) -> None:
+    """Intra-op threads for the eager and TorchScript backends (process-wide); ONNX sessions take their own."""
+    if threads and backend != "onnx":
+        torch.set_num_threads(threads)
+
+
+def trace_module(module: torch.nn.Module, example: torch.Tensor) -> torch.jit.ScriptModule:
+    """TorchScript-trace a module and freeze it (weights folded into the graph as constants)."""
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example, check_trace=False)
+    return torch.jit.freeze(traced.eval())
+
+
+def onnx_path(export_dir: str, class_name: str, weights: str) -> str:
+    """Where the graph of class_name is exported; the weight hash in the name makes new weights re-export."""
+    return os.path.join(export_dir, f"{class_name}_{weights}.onnx")
+
+
+def export_onnx(module: torch.nn.Module, example, path: str, input_names: List[str], output_names: List[str],
+                dynamic_axes: Dict[str, Dict[int, str]], opset: int = 11) -> str:
+    """Export module to path unless an export for these weights is already there.
+
+    Pinned to the TorchScript-based exporter: the dynamo one needs onnxscript and does not take dynamic_axes.
+    """
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with torch.no_grad():
+            torch.onnx.export(module, example, path + ".tmp", input_names=input_names, output_names=output_names,
+                              dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+class OnnxSession:
+    """ONNX Runtime session on the CPU, called like the torch module it was exported from.
+
+    Inputs are torch tensors; outputs come back as a list of torch tensors in output order.
+    onnxruntime is only imported here, so the eager and TorchScript backends don't need it.
+    """
+
+    def __init__(self, path: str, threads: Optional[int] = None):
+        try:
+            import onnxruntime
+        except ImportError as error:
+            raise ImportError("The onnx backend needs the onnxruntime package") from error
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, *inputs: torch.Tensor) -> List[torch.Tensor]:
+        feed = {name: tensor.detach().cpu().numpy() for name, tensor in zip(self.input_names, inputs)}
+        return [torch.from_numpy(np.asarray(output)) for output in self.session.run(None, feed)]
+
+
+def warm_up(run: Callable[[], object], runs: int = 1) -> None:
+    """Run a few throw-away passes so lazy allocation, kernel selection and JIT profiling happen at load time."""
+    with torch.inference_mode():
+        for _ in range(runs):
+            run()
+
+
+def max_abs_diff(reference: Sequence[torch.Tensor], candidate: Sequence[torch.Tensor]) -> float:
+    """Largest element-wise difference between two lists of outputs; inf when their shapes disagree."""
+    worst = 0.0
+    for a, b in zip(reference, candidate):
+        if a.shape != b.shape:
+            return float("inf")
+        if a.numel():
+            worst = max(worst, (a.float() - b.float()).abs().max().item())
+    return worst if len(reference) == len(candidate) else float("inf")
+
+
+def max_rel_diff(reference: Sequence[torch.Tensor], candidate: Sequence[torch.Tensor]) -> float:
+    """max_abs_diff with each output scaled by its largest reference magnitude (floored at 1)."""
+    worst = 0.0
+    for a, b in zip(reference, candidate):
+        if a.numel():
+            worst = max(worst, max_abs_diff([a], [b]) / max(a.abs().max().item(), 1.0))
+    return worst if len(reference) == len(candidate) else float("inf")
+
+
+def matched_detection_diff(reference: Dict[str, torch.Tensor], candidate: Dict[str, torch.Tensor]) -> float:
+    """Difference between two detection sets that ignores the order near-tied scores come out in.
+
+    Scores are compared sorted; each reference box is matched to the closest candidate box of
+    its label, relative to the largest reference coordinate (floored at 1). inf when the counts differ.
+    """
+    if len(reference["scores"]) != len(candidate["scores"]):
+        return float("inf")
+    if not len(reference["scores"]):
+        return 0.0
+    scores = (reference["scores"].sort().values - candidate["scores"].sort().values).abs().max().item()
+    distance = torch.cdist(reference["boxes"].float(), candidate["boxes"].float(), p=float("inf"))
+    distance[reference["labels"][:, None] != candidate["labels"][None, :]] = float("inf")
+    boxes = distance.min(dim=1).values.max().item() / max(reference["boxes"].abs().max().item(), 1.0)
+    return max(scores, boxes)
+
+
+def quantize_onnx(path: str) -> str:
+    """Dynamic int8 copy of an exported graph (onnxruntime.quantization), made once next to it."""
+    quantized = path[:-len(".onnx")] + "_int8.onnx"
+    if not os.path.exists(quantized):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+    return quantized
@@ -0,0 +1,128 @@
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from models.Profiler import PROFILER
+
+
+class BoxMask:
+    """A binary mask kept only inside its box; the full-image array is built when someone asks for it."""
+    __slots__ = ("patch", "box", "size")
+
+    def __init__(self, patch: np.ndarray, box: Tuple[int, int, int, int], size: Tuple[int, int]):
+        self.patch = patch
+        self.box = box
+        self.size = size
+
+    @property
+    def nbytes(self) -> int:
+        return self.patch.nbytes
+
+    def to_array(self) -> np.ndarray:
+        width, height = self.size
+        x0, y0 = self.box[:2]
+        rows, cols = self.patch.shape
+        full = np.zeros((height, width), dtype=bool)
+        # The patch may be smaller than the box where the box runs past the image edge.
+        full[y0:y0 + rows, x0:x0 + cols] = self.patch
+        return full
+
+
+class Detection:
+    """A segmentor hit: box, label and score, with crop and mask pixels materialized on first access.
+
+    The crop is cut from the source image only when someone asks for pixels, and the mask is
+    kept as the segmentor handed it over (a box-sized BoxMask patch, or an array or tensor)
+    until a full-frame array is asked for. Iterating yields the legacy (crop, mask, label) tuple.
+    """
+    __slots__ = ("box", "label", "score", "_image", "_mask_source", "_crop", "_mask")
+
+    def __init__(self, box: Optional[Tuple[int, int, int, int]], label: str, score: Optional[float] = None,
+                 image: Optional[Image.Image] = None, mask_source=None):
+        self.box = box
+        self.label = label
+        self.score = score
+        self._image = image
+        self._mask_source = mask_source
+        self._crop: Optional[Image.Image] = None
+        self._mask: Optional[Image.Image] = None
+
+    @classmethod
+    def from_legacy(cls, crop: Image.Image, mask: Optional[Image.Image], label: str) -> "Detection":
+        det = cls(None, label)
+        det._crop = crop
+        det._mask = mask
+        return det
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        """The full image this detection was cut from (None for legacy tuples)."""
+        return self._image
+
+    @property
+    def crop(self) -> Image.Image:
+        if self._crop is None:
+            PROFILER.count("Detection.crop")
+            self._crop = self._image.crop(self.box)
+        return self._crop
+
+    def mask_array(self) -> Optional[np.ndarray]:
+        """Binary mask as a bool array (full image size), without building a PIL image."""
+        if self._mask is not None:
+            return np.asarray(self._mask) > 0
+        if self._mask_source is None:
+            return None
+        source = self._mask_source
+        if isinstance(source, BoxMask):
+            return source.to_array()
+        if hasattr(source, "cpu"):
+            source = source.cpu().numpy()
+        return source if source.dtype == np.bool_ else source > 0.5
+
+    def mask_patch(self) -> Optional[np.ndarray]:
+        """Binary mask inside the box only (box height x width); never builds the full-image array."""
+        source = self._mask_source
+        if isinstance(source, BoxMask):
+            return source.patch
+        if self.box is None:
+            return None
+        x0, y0, x1, y1 = self.box
+        if source is None:
+            return np.asarray(self._mask)[y0:y1, x0:x1] > 0 if self._mask is not None else None
+        # Slice before the copy, so only the box leaves the device.
+        patch = source[y0:y1, x0:x1]
+        if hasattr(patch, "cpu"):
+            patch = patch.cpu().numpy()
+        return patch if patch.dtype == np.bool_ else patch > 0.5
+
+    @property
+    def mask(self) -> Optional[Image.Image]:
+        if self._mask is None:
+            array = self.mask_array()
+            if array is None:
+                return None
+            self._mask = Image.fromarray(array.astype(np.uint8) * 255)
+        return self._mask
+
+    @property
+    def nbytes(self) -> int:
+        total = 0
+        source = self._mask_source
+        if source is not None:
+            total += source.nelement() * source.element_size() if hasattr(source, "nelement") else source.nbytes
+        for image in (self._crop, self._mask):
+            if image is not None:
+                total += image.width * image.height * len(image.getbands())
+        return total
+
+    def __iter__(self) -> Iterator:
+        yield self.crop
+        yield self.mask
+        yield self.label
+
+    def __repr__(self):
+        return f"Detection({self.label!r}, box={self.box}, score={self.score})"
+
+
+def as_detections(detections: list) -> List[Detection]:
+    """Accept (crop, mask, label) tuples from older segmentors alongside Detection records."""
+    return [d if isinstance(d, Detection) else Detection.from_legacy(*d) for d in detections]
@@ -0,0 +1,135 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from PIL import Image
+from models.Detection import Detection, as_detections
+
+
+# id(image) -> (weakref, digest). Images are treated as immutable once hashed.
+_HASHES: Dict[int, Tuple[weakref.ref, str]] = {}
+
+
+def content_hash(image: Image.Image) -> str:
+    """Hash of an image's pixels, computed once per live image object."""
+    ident = id(image)
+    entry = _HASHES.get(ident)
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode())
+    value = digest.hexdigest()
+    _HASHES[ident] = (weakref.ref(image, lambda _, ident=ident: _HASHES.pop(ident, None)), value)
+    return value
+
+
+def image_key(image: Image.Image, mode: str = "content") -> Hashable:
+    """Key an image either by object identity or by a hash of its pixels."""
+    if mode == "identity":
+        return ("id", id(image))
+    return ("sha", content_hash(image))
+
+
+def estimate_nbytes(detections: List[Detection]) -> int:
+    return sum(det.nbytes for det in detections)
+
+
+class DetectionCache:
+    """LRU cache of segmentor outputs, bounded by entry count and/or byte size. Safe to share between threads.
+
+    Pinned keys are never evicted, so the cache may run over its bounds while pins are held.
+    """
+
+    def __init__(self, max_entries: Optional[int] = 32, max_bytes: Optional[int] = 512 * 1024 * 1024,
+                 key_mode: str = "content"):
+        if key_mode not in ("content", "identity"):
+            raise ValueError(f"Unknown cache key mode: {key_mode}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.key_mode = key_mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, Optional[Image.Image]]]" = OrderedDict()
+        self._pins: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, model_name: str, image: Image.Image, options: Optional[dict]) -> Hashable:
+        return (model_name, tuple(sorted(options.items())) if options else (), image_key(image, self.key_mode))
+
+    def get(self, model_name: str, image: Image.Image, options: Optional[dict] = None):
+        key = self._key(model_name, image, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, model_name: str, image: Image.Image, detections, options: Optional[dict] = None) -> List[Detection]:
+        detections = as_detections(detections)
+        key = self._key(model_name, image, options)
+        size = estimate_nbytes(detections)
+        # Identity keys hold a reference to the image so its id() cannot be reused while cached.
+        pinned = image if self.key_mode == "identity" else None
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (detections, size, pinned)
+            self.nbytes += size
+            self._evict()
+        return detections
+
+    def pin(self, model_name: str, image: Image.Image, options: Optional[dict] = None) -> None:
+        """Keep the entry for image (present or still to be put) until a matching unpin."""
+        key = self._key(model_name, image, options)
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, model_name: str, image: Image.Image, options: Optional[dict] = None) -> None:
+        key = self._key(model_name, image, options)
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries) or
+            (self.max_bytes is not None and self.nbytes > self.max_bytes and len(self._entries) > 1)
+        ):
+            # Oldest unpinned entry first.
+            key = next((k for k in self._entries if k not in self._pins), None)
+            if key is None:
+                return
+            self.nbytes -= self._entries.pop(key)[1]
+            self.evictions += 1
+
+    def invalidate(self, model_name: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == model_name]:
+                self.nbytes -= self._entries.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,190 @@
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+NO_SCENE = "<none>"
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class _SceneScope:
+    __slots__ = ("local", "label", "previous")
+
+    def __init__(self, local: threading.local, label: str):
+        self.local = local
+        self.label = label
+
+    def __enter__(self):
+        self.previous = getattr(self.local, "scene", NO_SCENE)
+        self.local.scene = self.label
+        return self
+
+    def __exit__(self, *exc):
+        self.local.scene = self.previous
+        return False
+
+
+class Profiler:
+    """Timers and counters around the hot paths (parsing, model loading, queries, predicts, rules).
+
+    Disabled by default: span() then hands back a shared no-op context and count() returns at
+    once, so instrumented code pays one attribute check. Enabled, every span adds to a per-name
+    total and to the total of the scene set by scene() on the current thread; with trace=True
+    each span is also kept as a Chrome trace event. Spans nest, so totals are inclusive.
+    Only the current process is measured: profile with workers=1 (inline or staged pipeline).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            # name -> [count, total seconds, max seconds]
+            self.spans: Dict[str, List[float]] = {}
+            self.scenes: Dict[str, Dict[str, List[float]]] = {}
+            self.counters: Dict[str, int] = {}
+            self.events: List[dict] = []
+            self._origin = time.perf_counter()
+
+    def enable(self, trace: bool = False) -> "Profiler":
+        self.trace = trace
+        self.enabled = True
+        return self
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def scene(self, label: str):
+        """Attribute the spans of this thread to scene label until the block exits."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _SceneScope(self._local, label)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _record(self, name: str, start: float, end: float, args: dict) -> None:
+        elapsed = end - start
+        scene = getattr(self._local, "scene", NO_SCENE)
+        with self._lock:
+            for table in (self.spans, self.scenes.setdefault(scene, {})):
+                entry = table.get(name)
+                if entry is None:
+                    table[name] = [1, elapsed, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    if elapsed > entry[2]:
+                        entry[2] = elapsed
+            if self.trace:
+                event = {"name": name, "ph": "X", "ts": (start - self._origin) * 1e6, "dur": elapsed * 1e6,
+                         "pid": os.getpid(), "tid": threading.get_ident()}
+                if args or scene != NO_SCENE:
+                    event["args"] = {**args, "scene": scene}
+                self.events.append(event)
+
+    @staticmethod
+    def _summary(table: Dict[str, List[float]]) -> Dict[str, dict]:
+        return {
+            name: {"count": count, "total_ms": total * 1e3, "mean_ms": total * 1e3 / count, "max_ms": peak * 1e3}
+            for name, (count, total, peak) in sorted(table.items(), key=lambda item: -item[1][1])
+        }
+
+    def report(self) -> dict:
+        """Span totals overall and per scene (rules are the rule:<name> spans), plus counters."""
+        with self._lock:
+            return {
+                "spans": self._summary(self.spans),
+                "scenes": {scene: self._summary(table) for scene, table in self.scenes.items()},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def format_report(self, per_scene: bool = False) -> str:
+        report = self.report()
+        lines = [f"{'span':<48}{'count':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}"]
+        sections = [("", report["spans"])]
+        if per_scene:
+            sections += [(f"[{scene}] ", spans) for scene, spans in report["scenes"].items()]
+        for prefix, spans in sections:
+            for name, s in spans.items():
+                lines.append(f"{(prefix + name)[:47]:<48}{s['count']:>8}{s['total_ms']:>12.2f}"
+                             f"{s['mean_ms']:>10.3f}{s['max_ms']:>10.3f}")
+        lines += [f"{name:<48}{value:>8}" for name, value in report["counters"].items()]
+        return "\n".join(lines)
+
+    def export_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write the recorded spans in Chrome trace format (chrome://tracing, Perfetto); needs enable(trace=True)."""
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"counters": dict(self.counters)}}, f)
+
+
+PROFILER = Profiler()
+
+
+def profiled(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Time every call of the decorated function under name (default: its qualified name) while profiling is on."""
+    def decorate(fn: Callable) -> Callable:
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return fn(*args, **kwargs)
+            with _Span(PROFILER, label, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def rule_name(rule: Callable) -> str:
+    return getattr(rule, "name", None) or getattr(rule, "__name__", None) or repr(rule)
@@ -1,10 +1,16 @@
 import os
 import json
-from typing import List, Union, Tuple
+from typing import Dict, Iterable, List, Optional, Union, Tuple
 from importlib import import_module
 from PIL import Image as PILImage
 import matplotlib.pyplot as plt
 from models.model import Model, Segmentor, Classifier
+from models.DetectionCache import DetectionCache, content_hash
+from models.ResultStore import ResultStore, weights_fingerprint
+from models.Detection import Detection
+from models.Registry import ModelHandle, ModelRegistry, build_key_index
+from models.Profiler import PROFILER, profiled
+from models.Backends import backend_tag, preprocess_tag, version_suffix
 
 DevMode = True
 OUTPUT_DIR = "C://VLNLP//Test//D7K//Language//models//Debug"
@@ -29,107 +35,222 @@ MODEL_REGISTRY_JSON = [
 ]
 
 MODEL_LOOKUP = {entry["class"]: entry for entry in MODEL_REGISTRY_JSON}
+KEY_INDEX = build_key_index(MODEL_REGISTRY_JSON)
 
-def load_model_registry() -> List[Model]:
-    registry = []
-    for model_info in MODEL_REGISTRY_JSON:
-        module_name = f"models.{model_info['module']}"
-        class_name = model_info["class"]
-        model_class = getattr(import_module(module_name), class_name)
-        registry.append(model_class())
-    return registry
+# One segmentor forward pass per image; every label-filtered query is served from it.
+DETECTION_CACHE = DetectionCache()
 
-def ensure_model_for(query_key: str, registry: List[Model]) -> List[Model]:
-    for model_info in MODEL_REGISTRY_JSON:
-        if query_key in model_info.get("OBJECTS", []) or \
-           query_key in model_info.get("ObjectType", []) or \
-           query_key.lower() == model_info.get("ATTR", "").lower():
-            class_name = model_info["class"]
-            if not any(m.__class__.__name__ == class_name for m in registry):
-                module_name = f"models.{model_info['module']}"
-                model_class = getattr(import_module(module_name), class_name)
-                instance = model_class()
-                registry.append(instance)
-                print(f"[INFO] Dynamically loaded: {class_name} for {query_key}")
-    return registry
+def configure_detection_cache(max_entries=32, max_bytes=512 * 1024 * 1024, key_mode="content") -> DetectionCache:
+    global DETECTION_CACHE
+    DETECTION_CACHE = DetectionCache(max_entries=max_entries, max_bytes=max_bytes, key_mode=key_mode)
+    return DETECTION_CACHE
 
-import os
-import json
-from typing import List, Union, Tuple
-from importlib import import_module
-from PIL import Image as PILImage
-import matplotlib.pyplot as plt
-from models.model import Model, Segmentor, Classifier
+# Optional on-disk store consulted after the in-memory cache and before any model runs.
+RESULT_STORE: Optional[ResultStore] = None
 
-DevMode = True
-OUTPUT_DIR = "C://VLNLP//Test//D7K//Language//models//Debug"
+def configure_result_store(path: Optional[str]) -> Optional[ResultStore]:
+    global RESULT_STORE
+    if RESULT_STORE is not None:
+        RESULT_STORE.close()
+    RESULT_STORE = ResultStore(path) if path else None
+    return RESULT_STORE
 
-MODEL_REGISTRY_JSON = [
-    {
-        "module": "TorchMaskRCNNShapeWSegmentor",
-        "class": "TorchMaskRCNNShapeWSegmentor",
-        "ATTR": "",
-        "TYPE": "SEGMENTOR",
-        "OBJECTS": ["sphere", "cone", "cylinder", "torus", "cube"],
-        "ObjectType": ["Object1"]
-    },
-    {
-        "module": "TorchMaterialClassifier",
-        "class": "TorchMaterialClassifier",
-        "ATTR": "material",
-        "TYPE": "CLASSIFIER",
-        "OBJECTS": [],
-        "ObjectType": []
-    }
-]
+_SHARED_REGISTRY: Optional[ModelRegistry] = None
 
-MODEL_LOOKUP = {entry["class"]: entry for entry in MODEL_REGISTRY_JSON}
+def get_model_registry() -> ModelRegistry:
+    """Process-wide registry; models are constructed on first use and then reused."""
+    global _SHARED_REGISTRY
+    if _SHARED_REGISTRY is None:
+        _SHARED_REGISTRY = ModelRegistry(MODEL_REGISTRY_JSON, on_evict=lambda name: DETECTION_CACHE.invalidate(name))
+    return _SHARED_REGISTRY
 
-def load_model_registry() -> List[Model]:
-    registry = []
-    for model_info in MODEL_REGISTRY_JSON:
-        module_name = f"models.{model_info['module']}"
-        class_name = model_info["class"]
-        model_class = getattr(import_module(module_name), class_name)
-        registry.append(model_class())
-    return registry
+@profiled("load_model_registry")
+def load_model_registry() -> ModelRegistry:
+    return get_model_registry().preload()
 
-def ensure_model_for(query_key: str, registry: List[Model]) -> List[Model]:
-    for model_info in MODEL_REGISTRY_JSON:
-        if query_key in model_info.get("OBJECTS", []) or query_key.lower() == model_info.get("ATTR", "").lower():
-            class_name = model_info["class"]
-            if not any(m.__class__.__name__ == class_name for m in registry):
-                module_name = f"models.{model_info['module']}"
-                model_class = getattr(import_module(module_name), class_name)
-                instance = model_class()
-                registry.append(instance)
-                print(f"[INFO] Dynamically loaded: {class_name} for {query_key}")
-    return registry
+def model_versions(class_names: Optional[Iterable[str]] = None,
+                   registry: Optional[ModelRegistry] = None) -> Dict[str, str]:
+    """Weight-file hash of each registry model class, read from WEIGHTS_PATH without building the model.
+
+    Entries come from registry, or the process-wide one (get_model_registry()) when it is None.
+    """
+    entries = (registry if registry is not None else get_model_registry()).entries
+    versions = {}
+    for class_name in (class_names if class_names is not None else entries):
+        entry = entries[class_name]
+        model_class = getattr(import_module(f"models.{entry['module']}"), class_name)
+        weights = weights_fingerprint(getattr(model_class, "WEIGHTS_PATH", None))
+        versions[class_name] = weights + version_suffix(backend_tag(**entry.get("BACKEND", {})),
+                                                        preprocess_tag(**entry.get("PREPROCESS", {})))
+    return versions
+
+def _key_index(registry: Union[ModelRegistry, List[Model], None]) -> Dict[str, List[ModelHandle]]:
+    """A registry's own key index; None means the process-wide registry, a plain model list the static table."""
+    if registry is None:
+        registry = get_model_registry()
+    return registry.index if isinstance(registry, ModelRegistry) else KEY_INDEX
+
+def lookup_key(query_key: str, registry: Union[ModelRegistry, List[Model], None] = None) -> List[ModelHandle]:
+    return _key_index(registry).get(query_key.lower(), [])
+
+def is_attribute_key(query_key: str, registry: Union[ModelRegistry, List[Model], None] = None) -> bool:
+    return any(h.role == "attribute" for h in lookup_key(query_key, registry))
+
+def is_object_key(query_key: str, registry: Union[ModelRegistry, List[Model], None] = None) -> bool:
+    return any(h.role != "attribute" for h in lookup_key(query_key, registry))
 
-def query(image: PILImage.Image, query_key: str, registry: List[Model]) -> Union[str, List[Tuple[str, str, PILImage.Image]]]:
-    registry = ensure_model_for(query_key, registry)
+def models_for_keys(query_keys: Iterable[str], registry: Union[ModelRegistry, List[Model], None] = None) -> List[str]:
+    """Registry class names needed to answer the given object labels, object types and attributes."""
+    registry = registry if registry is not None else get_model_registry()
+    needed = {h.class_name for key in query_keys for h in lookup_key(key, registry)}
+    entries = registry.entries if isinstance(registry, ModelRegistry) else MODEL_LOOKUP
+    return [name for name in entries if name in needed]
 
+def model_for(handle: ModelHandle, registry: Union[ModelRegistry, List[Model]]) -> Model:
+    if isinstance(registry, ModelRegistry):
+        return registry.get(handle.class_name)
     for model in registry:
-        model_info = MODEL_LOOKUP.get(model.__class__.__name__, {})
-        model_type = model_info.get("TYPE", "")
+        if model.__class__.__name__ == handle.class_name:
+            return model
+    model_info = MODEL_LOOKUP[handle.class_name]
+    model_class = getattr(import_module(f"models.{model_info['module']}"), handle.class_name)
+    model = model_class()
+    registry.append(model)
+    print(f"[INFO] Dynamically loaded: {handle.class_name}")
+    return model
 
-        if model_type == "SEGMENTOR":
-            detections = model.predict(image)
-            object_type = model_info["ObjectType"][0] if model_info["ObjectType"] else ""
+@profiled("ensure_model_for")
+def ensure_model_for(query_key: str, registry: Union[ModelRegistry, List[Model]]) -> Union[ModelRegistry, List[Model]]:
+    for handle in lookup_key(query_key, registry):
+        model_for(handle, registry)
+    return registry
+
+def _pixels(source: Union[PILImage.Image, Detection]) -> PILImage.Image:
+    return source.crop if isinstance(source, Detection) else source
+
+def _options_key(options: Optional[dict]) -> str:
+    return json.dumps(options, sort_keys=True) if options else ""
+
+def item_key(source: Union[PILImage.Image, Detection]) -> str:
+    """Store key of a classifier input; detections use their parent image hash and box, so no crop is cut."""
+    if isinstance(source, Detection) and source.box is not None and source.image is not None:
+        return f"{content_hash(source.image)}:{','.join(map(str, source.box))}"
+    return content_hash(_pixels(source))
+
+def detect(model: Model, image: PILImage.Image, options: Optional[dict] = None) -> List[Detection]:
+    """Segmentor output for image: in-memory cache first, then the result store, then the model."""
+    name = model.__class__.__name__
+    detections = DETECTION_CACHE.get(name, image, options)
+    if detections is not None:
+        PROFILER.count("detection_cache.hit")
+        return detections
+    if RESULT_STORE is not None:
+        stored = RESULT_STORE.get_detections(content_hash(image), model, _options_key(options), image)
+        if stored is not None:
+            PROFILER.count("result_store.hit")
+            return DETECTION_CACHE.put(name, image, stored, options)
+    with PROFILER.span(f"{name}.predict", batch=1):
+        predicted = model.predict(image, **options) if options else model.predict(image)
+    detections = DETECTION_CACHE.put(name, image, predicted, options)
+    if RESULT_STORE is not None:
+        RESULT_STORE.put_detections(content_hash(image), model, _options_key(options), detections)
+    return detections
+
+def classify(model: Model, sources: List[Union[PILImage.Image, Detection]]) -> list:
+    """Classifier output per source, reading and filling the result store when one is configured."""
+    name = model.__class__.__name__
+    if RESULT_STORE is None:
+        with PROFILER.span(f"{name}.predict", batch=len(sources)):
+            if len(sources) == 1:
+                return [model.predict(_pixels(sources[0]))]
+            return model.predict_batch([_pixels(source) for source in sources])
+    keys = [item_key(source) for source in sources]
+    found = RESULT_STORE.get_attributes(set(keys), model)
+    PROFILER.count("result_store.hit", len(found))
+    missing = [i for i, key in enumerate(keys) if key not in found]
+    if missing:
+        with PROFILER.span(f"{name}.predict", batch=len(missing)):
+            predicted = model.predict_batch([_pixels(sources[i]) for i in missing])
+        fresh = {keys[i]: value for i, value in zip(missing, predicted)}
+        RESULT_STORE.put_attributes(fresh, model)
+        found.update(fresh)
+    return [found[key] for key in keys]
 
-            if query_key in model_info.get("OBJECTS", []):
-                # Filter
-                filtered = [
-                    (object_type, label, crop)
-                    for crop, _, label in detections if label.lower() == query_key.lower()
-                ]
-                return filtered if filtered else f"No objects of type {query_key} found."
+@profiled("query")
+def query(image: Union[PILImage.Image, Detection], query_key: str, registry: Union[ModelRegistry, List[Model]],
+          **options) -> Union[str, List[Tuple[str, str, Detection]]]:
+    """Answer query_key for image. options (score_threshold, top_k, nms_iou) tune segmentor post-processing."""
+    for handle in lookup_key(query_key, registry):
+        model = model_for(handle, registry)
 
-            elif query_key in model_info.get("ObjectType", []):
-                # Return all 
-                return [(object_type, label, crop) for crop, _, label in detections]
+        if handle.role == "attribute":
+            return classify(model, [image])[0]
 
-        if model_type == "CLASSIFIER" and query_key.lower() == model_info.get("ATTR", "").lower():
-            return model.predict(image)
+        detections = detect(model, _pixels(image), options)
+        if handle.role == "label":
+            # Filter
+            key = query_key.lower()
+            filtered = [
+                (handle.object_type, det.label, det)
+                for det in detections if det.label.lower() == key
+            ]
+            return filtered if filtered else f"No objects of type {query_key} found."
+
+        # Return all
+        return [(handle.object_type, det.label, det) for det in detections]
 
     return f"No model found that can handle: {query_key}"
+
+@profiled("query_batch")
+def query_batch(images: List[Union[PILImage.Image, Detection]], query_key: str, registry: Union[ModelRegistry, List[Model]],
+                **options) -> List[Union[str, List[Tuple[str, str, Detection]]]]:
+    """Answer the same query for several images, in one forward pass where a classifier supports it."""
+    if not images:
+        return []
+    handles = lookup_key(query_key, registry)
+    if handles and handles[0].role == "attribute":
+        return classify(model_for(handles[0], registry), images)
+
+    return [query(image, query_key, registry, **options) for image in images]
+
+def segmentors_for(registry: Union[ModelRegistry, List[Model]], class_names: Optional[Iterable[str]] = None) -> List[Model]:
+    wanted = set(class_names) if class_names is not None else None
+    if isinstance(registry, ModelRegistry):
+        return [registry.get(name) for name, info in registry.entries.items()
+                if info.get("TYPE") == "SEGMENTOR" and (wanted is None or name in wanted)]
+    return [m for m in registry if MODEL_LOOKUP.get(m.__class__.__name__, {}).get("TYPE") == "SEGMENTOR"
+            and (wanted is None or m.__class__.__name__ in wanted)]
+
+def prefetch_detections(images: List[PILImage.Image], registry: Union[ModelRegistry, List[Model]], batch_size: int = 4,
+                        class_names: Optional[Iterable[str]] = None, **options) -> List[list]:
+    """Segment images in mini-batches and seed DETECTION_CACHE so later queries on them are hits.
+
+    Only segmentors named in class_names run when it is given. Returns the detections of the
+    first segmentor, one list per image.
+    """
+    per_image: List[list] = [None] * len(images)
+    for position, model in enumerate(segmentors_for(registry, class_names)):
+        name = model.__class__.__name__
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            found = [DETECTION_CACHE.get(name, image, options) for image in chunk]
+            missing = [i for i, detections in enumerate(found) if detections is None]
+            PROFILER.count("detection_cache.hit", len(chunk) - len(missing))
+            if missing and RESULT_STORE is not None:
+                for i in missing:
+                    stored = RESULT_STORE.get_detections(content_hash(chunk[i]), model, _options_key(options), chunk[i])
+                    if stored is not None:
+                        PROFILER.count("result_store.hit")
+                        found[i] = DETECTION_CACHE.put(name, chunk[i], stored, options)
+                missing = [i for i in missing if found[i] is None]
+            if missing:
+                pending = [chunk[i] for i in missing]
+                with PROFILER.span(f"{name}.predict", batch=len(pending)):
+                    batch = model.predict_batch(pending, **options) if options else model.predict_batch(pending)
+                for i, detections in zip(missing, batch):
+                    found[i] = DETECTION_CACHE.put(name, chunk[i], detections, options)
+                    if RESULT_STORE is not None:
+                        RESULT_STORE.put_detections(content_hash(chunk[i]), model, _options_key(options), found[i])
+            if position == 0:
+                per_image[start:start + len(chunk)] = found
+    return per_image
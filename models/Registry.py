@@ -0,0 +1,123 @@
+import threading
+from importlib import import_module
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from models.model import Model
+from models.Profiler import PROFILER
+
+
+class ModelHandle:
+    """One way a registry entry can answer a query key: as a detected label, an object type or an attribute."""
+    __slots__ = ("class_name", "kind", "role", "object_type")
+
+    def __init__(self, class_name: str, kind: str, role: str, object_type: str):
+        self.class_name = class_name
+        self.kind = kind
+        self.role = role
+        self.object_type = object_type
+
+    def __repr__(self):
+        return f"ModelHandle({self.class_name}, {self.role})"
+
+
+def build_key_index(entries: List[dict]) -> Dict[str, List[ModelHandle]]:
+    """Map each lower-cased label, object type and attribute name to the entries that answer it."""
+    index: Dict[str, List[ModelHandle]] = {}
+    for entry in entries:
+        kind = entry.get("TYPE", "")
+        object_type = entry["ObjectType"][0] if entry.get("ObjectType") else ""
+        keys = []
+        if kind == "SEGMENTOR":
+            keys += [(label, "label") for label in entry.get("OBJECTS", [])]
+            keys += [(type_name, "object_type") for type_name in entry.get("ObjectType", [])]
+        elif kind == "CLASSIFIER" and entry.get("ATTR"):
+            keys.append((entry["ATTR"], "attribute"))
+        for key, role in keys:
+            handles = index.setdefault(key.lower(), [])
+            if not any(h.class_name == entry["class"] for h in handles):
+                handles.append(ModelHandle(entry["class"], kind, role, object_type))
+    return index
+
+
+class ModelRegistry:
+    """Process-wide pool of model instances, built lazily from registry entries.
+
+    Iterating yields only the models that are currently loaded, in registry order,
+    so it can stand in for the plain ``List[Model]`` that ``query`` used to receive.
+    An entry's optional "BACKEND" dict (backend, quantize, channels_last, ...) is passed to the
+    model's configure_backend when it is built, "PREPROCESS" (max_side, tile, ...) to its
+    configure_preprocess, and "WARMUP" (default 1) warm-up passes run before it is handed out.
+    "ARGS", if present, holds keyword arguments for the model's constructor.
+    """
+
+    def __init__(self, entries: List[dict], on_evict: Optional[Callable[[str], None]] = None):
+        self.entries: Dict[str, dict] = {entry["class"]: entry for entry in entries}
+        self.index = build_key_index(entries)
+        self.on_evict = on_evict
+        self._models: Dict[str, Model] = {}
+        self._lock = threading.RLock()
+
+    def _instantiate(self, class_name: str) -> Model:
+        model_info = self.entries[class_name]
+        module_name = f"models.{model_info['module']}"
+        with PROFILER.span(f"load:{class_name}"):
+            model_class = getattr(import_module(module_name), class_name)
+            model = model_class(**model_info.get("ARGS", {}))
+        backend = model_info.get("BACKEND")
+        if backend and hasattr(model, "configure_backend"):
+            report = model.configure_backend(**backend)
+            print(f"[INFO] {class_name} running on {report['backend']} (max diff vs eager: {report['max_abs_diff']:.2e})")
+        preprocess = model_info.get("PREPROCESS")
+        if preprocess and hasattr(model, "configure_preprocess"):
+            model.configure_preprocess(**preprocess)
+        runs = model_info.get("WARMUP", 1)
+        if runs and hasattr(model, "warm_up"):
+            with PROFILER.span(f"warm_up:{class_name}"):
+                model.warm_up(runs)
+        return model
+
+    def get(self, class_name: str) -> Model:
+        model = self._models.get(class_name)
+        if model is not None:
+            return model
+        with self._lock:
+            if class_name not in self._models:
+                self._models[class_name] = self._instantiate(class_name)
+                print(f"[INFO] Loaded model: {class_name}")
+            return self._models[class_name]
+
+    def lookup(self, query_key: str) -> List[ModelHandle]:
+        return self.index.get(query_key.lower(), [])
+
+    def is_loaded(self, class_name: str) -> bool:
+        return class_name in self._models
+
+    def preload(self, class_names: Optional[Iterable[str]] = None) -> "ModelRegistry":
+        for class_name in (class_names if class_names is not None else list(self.entries)):
+            self.get(class_name)
+        return self
+
+    def evict(self, class_names: Optional[Iterable[str]] = None) -> None:
+        with self._lock:
+            for class_name in (list(class_names) if class_names is not None else list(self._models)):
+                if self._models.pop(class_name, None) is not None and self.on_evict:
+                    self.on_evict(class_name)
+
+    def reload(self, class_name: str) -> Model:
+        with self._lock:
+            self.evict([class_name])
+            return self.get(class_name)
+
+    def append(self, model: Model) -> None:
+        with self._lock:
+            self._models[model.__class__.__name__] = model
+
+    def __iter__(self) -> Iterator[Model]:
+        loaded = self._models
+        return iter([loaded[name] for name in self.entries if name in loaded] +
+                    [m for name, m in loaded.items() if name not in self.entries])
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def __contains__(self, class_name: str) -> bool:
+        return class_name in self._models
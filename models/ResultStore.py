@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from models.Detection import BoxMask, Detection
+from models.Backends import version_suffix
+
+_WEIGHT_HASHES: Dict[Tuple[str, int, float], str] = {}
+
+
+def weights_fingerprint(path: Optional[str]) -> str:
+    """SHA-256 prefix of a weight file, memoized per (path, size, mtime)."""
+    if not path or not os.path.exists(path):
+        return "unversioned"
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _WEIGHT_HASHES:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _WEIGHT_HASHES[key] = digest.hexdigest()[:16]
+    return _WEIGHT_HASHES[key]
+
+
+def model_version(model) -> Tuple[str, str]:
+    """(class name, weights hash); a non-eager backend or a resize policy is appended, since outputs differ."""
+    weights = weights_fingerprint(getattr(model, "WEIGHTS_PATH", None))
+    return model.__class__.__name__, weights + version_suffix(getattr(model, "backend_tag", ""),
+                                                              getattr(model, "preprocess_tag", ""))
+
+
+def encode_detections(detections: List[Detection]) -> Optional[bytes]:
+    """Pack boxes, labels, scores and bit-packed box-local masks into an .npz blob; None if not storable.
+
+    Masks are stored as the patch under each box, so a blob grows with the boxes, not the frame.
+    """
+    if any(det.box is None for det in detections):
+        return None
+    arrays = {
+        "boxes": np.array([det.box for det in detections], dtype=np.int32).reshape(-1, 4),
+        "scores": np.array([np.nan if det.score is None else det.score for det in detections], dtype=np.float32),
+        "labels": np.array([det.label for det in detections], dtype=str),
+    }
+    patches = [det.mask_patch() for det in detections]
+    if patches and all(patch is not None for patch in patches):
+        arrays["patch_shapes"] = np.array([patch.shape for patch in patches], dtype=np.int64).reshape(-1, 2)
+        arrays["patches"] = np.packbits(np.concatenate([patch.ravel() for patch in patches]))
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_detections(payload: bytes, image: Image.Image) -> List[Detection]:
+    """Detections of a stored blob; masks come back as BoxMask patches."""
+    with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+        boxes, scores, labels = data["boxes"].tolist(), data["scores"].tolist(), data["labels"].tolist()
+        masks = [None] * len(boxes)
+        if "patches" in data:
+            shapes = data["patch_shapes"]
+            offsets = np.concatenate([[0], np.cumsum(shapes.prod(axis=1))])
+            bits = np.unpackbits(data["patches"], count=int(offsets[-1])).astype(bool)
+            masks = [BoxMask(bits[offsets[i]:offsets[i + 1]].reshape(shape), tuple(box), image.size)
+                     for i, (shape, box) in enumerate(zip(shapes.tolist(), boxes))]
+    return [
+        Detection(tuple(box), label, None if np.isnan(score) else score, image, mask)
+        for box, label, score, mask in zip(boxes, labels, scores, masks)
+    ]
+
+
+class ResultStore:
+    """SQLite store of segmentor detections and classifier outputs.
+
+    Rows are keyed by image content hash, model class and weight-file hash, so re-running
+    changed rules over an unchanged archive never reaches a model.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS detections (image TEXT, model TEXT, weights TEXT, options TEXT, "
+                "payload BLOB, PRIMARY KEY (image, model, weights, options))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS attributes (item TEXT, model TEXT, weights TEXT, value TEXT, "
+                "PRIMARY KEY (item, model, weights))"
+            )
+
+    def get_detections(self, image_hash: str, model, options_key: str, image: Image.Image) -> Optional[List[Detection]]:
+        name, weights = model_version(model)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM detections WHERE image=? AND model=? AND weights=? AND options=?",
+                (image_hash, name, weights, options_key),
+            ).fetchone()
+        return decode_detections(row[0], image) if row else None
+
+    def put_detections(self, image_hash: str, model, options_key: str, detections: List[Detection]) -> None:
+        payload = encode_detections(detections)
+        if payload is None:
+            return
+        name, weights = model_version(model)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)",
+                (image_hash, name, weights, options_key, payload),
+            )
+
+    def get_attributes(self, item_keys: Iterable[str], model) -> Dict[str, str]:
+        name, weights = model_version(model)
+        item_keys = list(item_keys)
+        found: Dict[str, str] = {}
+        with self._lock:
+            for start in range(0, len(item_keys), 500):
+                chunk = item_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT item, value FROM attributes WHERE model=? AND weights=? "
+                    f"AND item IN ({','.join('?' * len(chunk))})",
+                    (name, weights, *chunk),
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_attributes(self, values: Dict[str, str], model) -> None:
+        name, weights = model_version(model)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO attributes VALUES (?, ?, ?, ?)",
+                [(item, name, weights, value) for item, value in values.items()],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
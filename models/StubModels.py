@@ -0,0 +1,95 @@
+import random
+import time
+from typing import List, Optional
+from PIL import Image
+from models.model import Segmentor, Classifier
+from models.Detection import Detection
+from models.DetectionCache import content_hash
+
+
+class StubSegmentor(Segmentor):
+    """CPU stand-in for the Mask R-CNN segmentor: fixed latency, detections seeded by image content.
+
+    The same image always yields the same detections, so benchmark runs are reproducible.
+    latency (default LATENCY) is charged once per image, batched or not; MAX_DETECTIONS bounds
+    the scene fan-out.
+    """
+    WEIGHTS_PATH = None
+    LATENCY = 0.005
+    MAX_DETECTIONS = 8
+    SHAPE_CLASSES = ["sphere", "cone", "cylinder", "torus", "cube"]
+
+    def __init__(self, latency: Optional[float] = None):
+        super().__init__("StubSegmentor")
+        self.latency = self.LATENCY if latency is None else latency
+
+    def can_segment(self, obj_name: str) -> bool:
+        return obj_name.lower() in self.SHAPE_CLASSES
+
+    def supported_objects(self) -> List[str]:
+        return list(self.SHAPE_CLASSES)
+
+    def _detect(self, image: Image.Image) -> List[Detection]:
+        rng = random.Random(content_hash(image))
+        width, height = image.size
+        detections = []
+        for _ in range(rng.randint(0, self.MAX_DETECTIONS)):
+            x, y = rng.randrange(max(width - 8, 1)), rng.randrange(max(height - 8, 1))
+            box = (x, y, min(x + rng.randint(4, 16), width), min(y + rng.randint(4, 16), height))
+            detections.append(Detection(box, rng.choice(self.SHAPE_CLASSES), rng.uniform(0.5, 1.0), image))
+        return detections
+
+    def predict(self, image: Image.Image) -> List[Detection]:
+        time.sleep(self.latency)
+        return self._detect(image)
+
+    def predict_batch(self, images: List[Image.Image]) -> List[List[Detection]]:
+        time.sleep(self.latency * len(images))
+        return [self._detect(image) for image in images]
+
+
+class StubClassifier(Classifier):
+    """CPU stand-in for the material classifier: latency (default LATENCY) per call plus ITEM_LATENCY per crop."""
+    WEIGHTS_PATH = None
+    LATENCY = 0.002
+    ITEM_LATENCY = 0.0001
+    MATERIAL_CLASSES = ["opaque", "transparent", "transparent_blue", "mirror", "gold"]
+
+    def __init__(self, latency: Optional[float] = None):
+        super().__init__("StubClassifier")
+        self.latency = self.LATENCY if latency is None else latency
+
+    def get_supported_attribute(self) -> str:
+        return "material"
+
+    def _classify(self, image: Image.Image) -> str:
+        return random.Random(content_hash(image)).choice(self.MATERIAL_CLASSES)
+
+    def predict(self, image: Image.Image) -> str:
+        time.sleep(self.latency + self.ITEM_LATENCY)
+        return self._classify(image)
+
+    def predict_batch(self, images: List[Image.Image]) -> List[str]:
+        time.sleep(self.latency + self.ITEM_LATENCY * len(images))
+        return [self._classify(image) for image in images]
+
+
+# Same keys as Query.MODEL_REGISTRY_JSON, so key lookups and rule analysis behave as with the real models.
+STUB_REGISTRY_JSON = [
+    {
+        "module": "StubModels",
+        "class": "StubSegmentor",
+        "ATTR": "",
+        "TYPE": "SEGMENTOR",
+        "OBJECTS": ["sphere", "cone", "cylinder", "torus", "cube"],
+        "ObjectType": ["Object1"]
+    },
+    {
+        "module": "StubModels",
+        "class": "StubClassifier",
+        "ATTR": "material",
+        "TYPE": "CLASSIFIER",
+        "OBJECTS": [],
+        "ObjectType": []
+    }
+]
@@ -1,17 +1,42 @@
 import os
 import json
+from collections import defaultdict
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict, Union
+from typing import Iterator, List, Tuple, Dict, Optional, Union
 from PIL import Image
 import torch
 import numpy as np
 import matplotlib.pyplot as plt
 from torchvision.transforms import Compose, Resize, ToTensor
 from torchvision.models.detection import maskrcnn_resnet50_fpn
+from torchvision.ops import batched_nms
 from models.model import Model, Segmentor, Classifier
+from models.Detection import BoxMask, Detection
+from models.Backends import (OnnxSession, backend_tag, channels_last_copy, channels_last_input, export_onnx,
+                             matched_detection_diff, max_abs_diff, max_rel_diff, onnx_path, preprocess_tag,
+                             quantize_linear, quantize_onnx, set_threads, warm_up)
+from models.ResultStore import weights_fingerprint
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+SCORE_THRESHOLD = 0.5
+MASK_THRESHOLD = 0.5
+# Padded pixels per batched mask resize; bounds the device memory one grid_sample call takes.
+MASK_BATCH_PIXELS = 1 << 22
+
+
+def _padded_batches(heights: List[int], widths: List[int], budget: int) -> Iterator[slice]:
+    """Consecutive runs of boxes whose shared padded size (count x tallest x widest) stays within budget."""
+    start, tallest, widest = 0, 0, 0
+    for k, (height, width) in enumerate(zip(heights, widths)):
+        grown = (max(tallest, height), max(widest, width))
+        if k > start and (k + 1 - start) * grown[0] * grown[1] > budget:
+            yield slice(start, k)
+            start, grown = k, (height, width)
+        tallest, widest = grown
+    if start < len(heights):
+        yield slice(start, len(heights))
 
 class TorchMaskRCNNShapeWSegmentor(Segmentor):
+    WEIGHTS_PATH = "C:/VLNLP/Test/D7K/COCO/mask_rcnn_model.pth"
     SHAPE_CLASSES = {
         1: "sphere",
         2: "cone",
@@ -22,27 +47,352 @@ class TorchMaskRCNNShapeWSegmentor(Segmentor):
 
     def __init__(self):
         super().__init__("TorchMaskRCNNSegmentor")
-        path = "C:/VLNLP/Test/D7K/COCO/mask_rcnn_model.pth"
+        path = self.WEIGHTS_PATH
         self.model = maskrcnn_resnet50_fpn(num_classes=len(self.SHAPE_CLASSES) + 1)
         self.model.load_state_dict(torch.load(path, map_location=device))
         self.model.to(device).eval()
+        self.score_threshold = SCORE_THRESHOLD
+        # Index -> label name; id 0 (background) and anything unmapped read as "unknown".
+        self._label_table = np.array(
+            ["unknown"] + [self.SHAPE_CLASSES.get(i, "unknown") for i in range(1, max(self.SHAPE_CLASSES) + 1)]
+        )
+        self.backend_tag = ""
+        self._backend = "eager"
+        self._forward = self.model
+        self.configure_preprocess()
+
+    OUTPUT_KEYS = ("boxes", "labels", "scores", "masks")
+
+    def _run(self, tensors: List[torch.Tensor]) -> List[dict]:
+        """Raw Mask R-CNN outputs (boxes, labels, scores, masks) per image tensor, through the configured backend."""
+        with torch.inference_mode():
+            if self._backend == "onnx":
+                # The exported graph takes one image at a time.
+                return [dict(zip(self.OUTPUT_KEYS, self._forward(tensor))) for tensor in tensors]
+            outputs = self._forward(tensors)
+        # A scripted detection model returns (losses, detections).
+        return outputs[1] if isinstance(outputs, tuple) else outputs
+
+    def _example_input(self) -> List[torch.Tensor]:
+        generator = torch.Generator().manual_seed(0)
+        return [torch.rand(3, 240, 320, generator=generator).to(device)]
+
+    def _head_outputs(self, forward, images: List[torch.Tensor]) -> Optional[List[torch.Tensor]]:
+        """Raw outputs of forward's backbone and box / mask heads on a fixed grid of proposals.
+
+        Unlike the detections, these don't depend on which near-tied boxes survive score
+        filtering and NMS. None when the backend exposes no submodules to call (ONNX).
+        """
+        backbone, heads = getattr(forward, "backbone", None), getattr(forward, "roi_heads", None)
+        if backbone is None or heads is None:
+            return None
+        with torch.inference_mode():
+            batch = self.model.transform(images)[0]
+            features = backbone(batch.tensors)
+            sizes = batch.image_sizes
+            proposals = []
+            for height, width in sizes:
+                # A 4 x 4 grid of quarter-size boxes.
+                corners = torch.cartesian_prod(torch.linspace(0, width * 0.75, 4), torch.linspace(0, height * 0.75, 4))
+                size = torch.tensor([width / 4, height / 4])
+                proposals.append(torch.cat([corners, corners + size], dim=1).to(device))
+            logits, deltas = heads.box_predictor(heads.box_head(heads.box_roi_pool(features, proposals, sizes)))
+            masks = heads.mask_predictor(heads.mask_head(heads.mask_roi_pool(features, proposals, sizes)))
+        return list(features.values()) + [logits, deltas, masks]
+
+    def configure_backend(self, backend: str = "eager", quantize: bool = False, channels_last: bool = False,
+                          export_dir: Optional[str] = None, parity_atol: Optional[float] = None,
+                          threads: Optional[int] = None) -> dict:
+        """Run inference through backend ("eager", "torchscript" or "onnx"); returns the parity report vs eager.
+
+        TorchScript scripts the whole detector (tracing can't follow its data-dependent control flow).
+        quantize applies dynamic int8 quantization to the Linear layers of the box head (CPU only);
+        channels_last stores a copy's conv weights NHWC and converts the batched input as it enters
+        the backbone. The raw backbone and head outputs on a fixed random image are compared with
+        eager, each difference relative to the output's scale (FPN activations run into the
+        hundreds); ONNX exposes no submodules, so there the detections are compared (matched
+        regardless of the order near-tied scores come out in) and must not be empty. A difference
+        above parity_atol (default 1e-3, or no limit when quantizing) raises RuntimeError and
+        leaves the model on eager. threads sets torch's intra-op thread count (process-wide) or,
+        for ONNX, the session's.
+        """
+        tag = backend_tag(backend, quantize, channels_last)
+        if quantize and device.type != "cpu":
+            raise ValueError("Dynamic int8 quantization runs on the CPU only")
+        set_threads(backend, threads)
+        example = self._example_input()
+        reference = self._run(example)
+        reference_heads = self._head_outputs(self.model, example)
+
+        module = quantize_linear(self.model) if quantize and backend != "onnx" else self.model
+        if channels_last:
+            module = channels_last_copy(module)
+            # GeneralizedRCNNTransform builds the batch itself, so the backbone converts its own input.
+            module.backbone.register_forward_pre_hook(channels_last_input)
+        if backend == "torchscript":
+            forward = torch.jit.script(module)
+        elif backend == "onnx":
+            folder = export_dir or os.path.join(os.path.dirname(self.WEIGHTS_PATH), "onnx")
+            target = onnx_path(folder, type(self).__name__, weights_fingerprint(self.WEIGHTS_PATH))
+            axes = {"image": {1: "height", 2: "width"}, **{key: {0: "detections"} for key in self.OUTPUT_KEYS}}
+            path = export_onnx(module, (example,), target, ["image"], list(self.OUTPUT_KEYS), axes)
+            forward = OnnxSession(quantize_onnx(path) if quantize else path, threads)
+        else:
+            forward = module
+
+        previous = self._forward, self._backend
+        self._forward, self._backend = forward, backend
+        candidate = self._run(example)
+        heads = self._head_outputs(forward, example)
+        report = {
+            "backend": tag or "eager",
+            "detections": [len(reference[0]["scores"]), len(candidate[0]["scores"])],
+            "detection_diff": matched_detection_diff(reference[0], candidate[0]),
+        }
+        if heads is not None:
+            report["max_abs_diff"] = max_abs_diff(reference_heads, heads)
+            report["max_rel_diff"] = difference = max_rel_diff(reference_heads, heads)
+        elif report["detections"][0]:
+            report["max_rel_diff"] = difference = report["detection_diff"]
+        else:
+            # Empty outputs always agree, so this check would have compared nothing.
+            self._forward, self._backend = previous
+            raise RuntimeError(f"{type(self).__name__} {report['backend']} parity input gave no detections to compare")
+        limit = parity_atol if parity_atol is not None else (None if quantize else 1e-3)
+        if limit is not None and difference > limit:
+            self._forward, self._backend = previous
+            raise RuntimeError(f"{type(self).__name__} {report['backend']} output differs from eager: {report}")
+        self.backend_tag = tag
+        return report
+
+    def warm_up(self, runs: int = 1) -> None:
+        warm_up(lambda: self._run(self._example_input()), runs)
+
+    def configure_preprocess(self, max_side: Optional[int] = None, tile: Optional[int] = None, overlap: int = 128,
+                             merge_iou: float = 0.5, tile_batch: int = 4) -> None:
+        """Bound what a large frame costs: downscale it, split it into tiles, or both.
+
+        max_side resizes so the longer side is at most that many pixels; boxes and masks are
+        scaled back to original coordinates. tile cuts the (resized) frame into tile x tile
+        windows overlapping by overlap pixels, runs them tile_batch at a time and merges
+        duplicates across tiles with a class-wise NMS at merge_iou. With a policy set, masks are
+        kept per box (BoxMask), so memory no longer grows with frame area times detections.
+        """
+        if tile is not None and not 0 <= overlap < tile:
+            raise ValueError(f"Tile overlap must be in [0, {tile}), got {overlap}")
+        self.max_side = max_side
+        self.tile = tile
+        self.overlap = overlap
+        self.merge_iou = merge_iou
+        self.tile_batch = max(1, tile_batch)
+        self.preprocess_tag = preprocess_tag(max_side, tile, overlap)
+
+    def _tiles(self, size: Tuple[int, int]) -> List[Tuple[int, int, int, int]]:
+        """Tile windows (x0, y0, x1, y1) covering an image of size; one window when no tiling applies."""
+        width, height = size
+        if not self.tile or max(width, height) <= self.tile:
+            return [(0, 0, width, height)]
+
+        def starts(length: int) -> List[int]:
+            if length <= self.tile:
+                return [0]
+            # The last window is pulled back to end on the edge, so every window is full size.
+            return list(range(0, length - self.tile, self.tile - self.overlap)) + [length - self.tile]
+
+        return [(x, y, min(x + self.tile, width), min(y + self.tile, height))
+                for y in starts(height) for x in starts(width)]
+
+    def _predict_policy(self, image: Image.Image, score_threshold: Optional[float] = None,
+                        top_k: Optional[int] = None, nms_iou: Optional[float] = None) -> List[Detection]:
+        """predict() under the configured resize / tiling policy."""
+        width, height = image.size
+        scale = 1.0
+        work = image
+        if self.max_side and max(width, height) > self.max_side:
+            scale = self.max_side / max(width, height)
+            work = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+
+        tiles = self._tiles(work.size)
+        by_size = defaultdict(list)
+        for index, (x0, y0, x1, y1) in enumerate(tiles):
+            by_size[(x1 - x0, y1 - y0)].append(index)
+        outputs = [None] * len(tiles)
+        for indices in by_size.values():
+            for start in range(0, len(indices), self.tile_batch):
+                chunk = indices[start:start + self.tile_batch]
+                tensors = [ToTensor()(work.crop(tiles[i])).to(device) for i in chunk]
+                for i, output in zip(chunk, self._run(tensors)):
+                    outputs[i] = output
+
+        threshold = self.score_threshold if score_threshold is None else score_threshold
+        boxes, labels, scores, sources = [], [], [], []
+        for index, ((x0, y0, _, _), output) in enumerate(zip(tiles, outputs)):
+            keep = torch.nonzero(output['scores'] >= threshold).flatten()
+            offset = torch.tensor([x0, y0, x0, y0], dtype=output['boxes'].dtype, device=output['boxes'].device)
+            boxes.append(output['boxes'][keep] + offset)
+            labels.append(output['labels'][keep])
+            scores.append(output['scores'][keep])
+            # (tile, detection) of every candidate, so the kept ones are found with one index op.
+            sources.append(torch.stack([torch.full_like(keep, index), keep], dim=1))
+        boxes, labels, scores, sources = torch.cat(boxes), torch.cat(labels), torch.cat(scores), torch.cat(sources)
+        if not len(scores):
+            return []
+
+        # Both return indices by decreasing score, which is the order top_k expects.
+        if len(tiles) > 1:
+            keep = batched_nms(boxes, scores, labels, self.merge_iou)
+        else:
+            keep = torch.argsort(scores, descending=True)
+        if nms_iou is not None:
+            keep = keep[batched_nms(boxes[keep], scores[keep], labels[keep], nms_iou)]
+        if top_k is not None:
+            keep = keep[:top_k]
+
+        meta = torch.cat([boxes[keep], labels[keep].unsqueeze(1).to(scores.dtype), scores[keep].unsqueeze(1),
+                          sources[keep].to(scores.dtype)], dim=1).cpu().numpy()
+        label_ids = meta[:, 4].astype(np.int64)
+        label_ids[(label_ids < 0) | (label_ids >= len(self._label_table))] = 0
+        names = self._label_table[label_ids].tolist()
+
+        # Boxes in original coordinates, clamped to the image and at least one pixel wide.
+        x0, y0, x1, y1 = (meta[:, :4] / scale).astype(np.int64).T
+        x0, y0 = np.clip(x0, 0, width - 1), np.clip(y0, 0, height - 1)
+        x1, y1 = np.maximum(np.clip(x1, 0, width), x0 + 1), np.maximum(np.clip(y1, 0, height), y0 + 1)
+        # The kept masks, gathered with one index op per tile. Every tile has the same size (see _tiles).
+        tile_ids, det_ids = meta[:, 6].astype(np.int64), meta[:, 7].astype(np.int64)
+        probabilities = outputs[0]['masks'].new_empty((len(meta),) + outputs[0]['masks'].shape[2:])
+        for index in np.unique(tile_ids).tolist():
+            rows = np.nonzero(tile_ids == index)[0]
+            probabilities[torch.as_tensor(rows, device=probabilities.device)] = \
+                outputs[index]['masks'][torch.as_tensor(det_ids[rows], device=probabilities.device), 0]
+        tile_height, tile_width = probabilities.shape[1:]
+        origins = np.array(tiles, dtype=np.int64)[tile_ids, :2]
+        # The same box in the tile's (scaled) coordinates, at least one mask pixel in each direction.
+        left = np.clip((x0 * scale).astype(np.int64) - origins[:, 0], 0, tile_width - 1)
+        top = np.clip((y0 * scale).astype(np.int64) - origins[:, 1], 0, tile_height - 1)
+        right = np.clip(np.ceil(x1 * scale).astype(np.int64) - origins[:, 0], left + 1, tile_width)
+        bottom = np.clip(np.ceil(y1 * scale).astype(np.int64) - origins[:, 1], top + 1, tile_height)
+        patches = self._box_masks(probabilities, np.stack([left, top, right, bottom], axis=1),
+                                  np.stack([y1 - y0, x1 - x0], axis=1))
+        return [
+            Detection(box, label, score, image, BoxMask(patch, box, image.size))
+            for box, label, score, patch in zip(zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()), names,
+                                                meta[:, 5].tolist(), patches)
+        ]
+
+    @staticmethod
+    def _box_masks(probabilities: torch.Tensor, regions: np.ndarray, sizes: np.ndarray) -> List[np.ndarray]:
+        """Region k (left, top, right, bottom) of probabilities[k], resized to sizes[k] (height, width) and binarized.
+
+        Sampled like a bilinear interpolate (align_corners=False) of each region on its own, but as
+        one grid_sample and one device-to-host copy per padded batch of boxes.
+        """
+        patches = []
+        tile_height, tile_width = probabilities.shape[1:]
+        for part in _padded_batches(sizes[:, 0].tolist(), sizes[:, 1].tolist(), MASK_BATCH_PIXELS):
+            region = torch.as_tensor(regions[part], dtype=torch.float32, device=probabilities.device)
+            size = torch.as_tensor(sizes[part], dtype=torch.float32, device=probabilities.device)
+            height, width = sizes[part].max(axis=0).tolist()
+            span_x, span_y = region[:, 2:3] - region[:, 0:1], region[:, 3:4] - region[:, 1:2]
+            xs = torch.arange(width, dtype=torch.float32, device=probabilities.device)[None] + 0.5
+            ys = torch.arange(height, dtype=torch.float32, device=probabilities.device)[None] + 0.5
+            # Source pixel of each output pixel, kept inside the region as interpolate keeps it inside its input.
+            source_x = region[:, 0:1] + torch.minimum((xs * span_x / size[:, 1:2] - 0.5).clamp(min=0), span_x - 1)
+            source_y = region[:, 1:2] + torch.minimum((ys * span_y / size[:, 0:1] - 0.5).clamp(min=0), span_y - 1)
+            grid = torch.stack([
+                ((source_x + 0.5) * (2 / tile_width) - 1)[:, None, :].expand(-1, height, -1),
+                ((source_y + 0.5) * (2 / tile_height) - 1)[:, :, None].expand(-1, -1, width),
+            ], dim=-1)
+            sampled = torch.nn.functional.grid_sample(probabilities[part, None].float(), grid, mode="bilinear",
+                                                      align_corners=False)
+            binary = (sampled[:, 0] > MASK_THRESHOLD).cpu().numpy()
+            # Copies, so the padded batch isn't kept alive by the patches cut from it.
+            patches.extend(binary[k, :h, :w].copy() for k, (h, w) in enumerate(sizes[part].tolist()))
+        return patches
 
     def can_segment(self, obj_name: str) -> bool:
         return obj_name.lower() in [x.lower() for x in self.SHAPE_CLASSES.values()]
 
-    def predict(self, image: Image.Image) -> List[Tuple[Image.Image, Image.Image, str]]:
-        image_tensor = ToTensor()(image).unsqueeze(0).to(device)
-        with torch.no_grad():
-            output = self.model(image_tensor)[0]
-        results = []
-        for box, mask, label, score in zip(output['boxes'], output['masks'], output['labels'], output['scores']):
-            if score < 0.5:
-                continue
-            x1, y1, x2, y2 = map(int, box.tolist())
-            crop = image.crop((x1, y1, x2, y2))
-            mask_img = Image.fromarray((mask[0].cpu().numpy() > 0.5).astype(np.uint8) * 255)
-            label_str = self.SHAPE_CLASSES.get(label.item(), "unknown")
-            results.append((crop, mask_img, label_str))
+    def predict(self, image: Image.Image, score_threshold: Optional[float] = None, top_k: Optional[int] = None,
+                nms_iou: Optional[float] = None) -> List[Detection]:
+        if self.max_side or self.tile:
+            return self._predict_policy(image, score_threshold, top_k, nms_iou)
+        output = self._run([ToTensor()(image).to(device)])[0]
+        return self._postprocess(image, output, score_threshold, top_k, nms_iou)
+
+    def predict_batch(self, images: List[Image.Image], score_threshold: Optional[float] = None,
+                      top_k: Optional[int] = None, nms_iou: Optional[float] = None) -> List[List[Detection]]:
+        if self.max_side or self.tile:
+            # Tiles of each frame are already batched; frames of different sizes can't share a batch anyway.
+            return [self._predict_policy(image, score_threshold, top_k, nms_iou) for image in images]
+        # Images of one size are batched together so the padded input, and therefore the
+        # detections, match what predict() would produce for each image on its own.
+        by_size = defaultdict(list)
+        for index, image in enumerate(images):
+            by_size[image.size].append(index)
+        results = [None] * len(images)
+        for indices in by_size.values():
+            tensors = [ToTensor()(images[i]).to(device) for i in indices]
+            outputs = self._run(tensors)
+            for i, output in zip(indices, outputs):
+                results[i] = self._postprocess(images[i], output, score_threshold, top_k, nms_iou)
         return results
+
+    def _postprocess(self, image: Image.Image, output, score_threshold: Optional[float] = None,
+                     top_k: Optional[int] = None, nms_iou: Optional[float] = None) -> List[Detection]:
+        threshold = self.score_threshold if score_threshold is None else score_threshold
+        scores = output['scores']
+        keep = torch.nonzero(scores >= threshold).flatten()
+        if nms_iou is not None and keep.numel():
+            nms_keep = batched_nms(output['boxes'][keep], scores[keep], output['labels'][keep], nms_iou)
+            keep = keep[nms_keep]
+        if top_k is not None:
+            # Mask R-CNN returns detections sorted by score, and batched_nms keeps that order.
+            keep = keep[:top_k]
+        if not keep.numel():
+            return []
+
+        # Boxes, labels and scores leave the device in one transfer. Each mask is binarized and cut
+        # to its box there, so a cached Detection holds a small bool patch rather than a full frame.
+        meta = torch.cat([
+            output['boxes'][keep],
+            output['labels'][keep].unsqueeze(1).to(scores.dtype),
+            scores[keep].unsqueeze(1),
+        ], dim=1).cpu().numpy()
+
+        boxes = meta[:, :4].astype(np.int64)
+        label_ids = meta[:, 4].astype(np.int64)
+        label_ids[(label_ids < 0) | (label_ids >= len(self._label_table))] = 0
+        labels = self._label_table[label_ids].tolist()
+        patches = self._box_crops(output['masks'][keep, 0], boxes)
+        return [
+            Detection(box, label, score, image, BoxMask(patch, box, image.size))
+            for box, label, score, patch in zip(map(tuple, boxes.tolist()), labels, meta[:, 5].tolist(), patches)
+        ]
+
+    @staticmethod
+    def _box_crops(masks: torch.Tensor, boxes: np.ndarray) -> List[np.ndarray]:
+        """masks[k] (full frame) under boxes[k], binarized; one gather and one device-to-host copy per padded batch.
+
+        A box running past the frame gives a patch cut at the frame edge.
+        """
+        frame_height, frame_width = masks.shape[1:]
+        x0, y0 = np.clip(boxes[:, 0], 0, frame_width), np.clip(boxes[:, 1], 0, frame_height)
+        widths = np.clip(boxes[:, 2], x0, frame_width) - x0
+        heights = np.clip(boxes[:, 3], y0, frame_height) - y0
+        patches = []
+        for part in _padded_batches(heights.tolist(), widths.tolist(), MASK_BATCH_PIXELS):
+            height, width = int(heights[part].max()), int(widths[part].max())
+            rows = torch.as_tensor(y0[part], device=masks.device)[:, None] + torch.arange(height, device=masks.device)
+            cols = torch.as_tensor(x0[part], device=masks.device)[:, None] + torch.arange(width, device=masks.device)
+            # Padding positions past the frame edge read its last row / column and are cut off below.
+            rows, cols = rows.clamp(max=frame_height - 1), cols.clamp(max=frame_width - 1)
+            which = torch.arange(len(rows), device=masks.device)[:, None, None]
+            binary = (masks[part][which, rows[:, :, None], cols[:, None, :]] > MASK_THRESHOLD).cpu().numpy()
+            # Copies, so the padded batch isn't kept alive by the patches cut from it.
+            patches.extend(binary[k, :h, :w].copy() for k, (h, w) in enumerate(zip(heights[part].tolist(),
+                                                                                     widths[part].tolist())))
+        return patches
+
     def supported_objects(self) -> List[str]:
         return ["sphere", "cone", "cylinder", "torus", "cube"]
@@ -8,20 +8,26 @@ import numpy as np
 import matplotlib.pyplot as plt
 from torchvision.transforms import Compose, Resize, ToTensor
 from torchvision.models.detection import maskrcnn_resnet50_fpn
+from typing import Optional
 from models.model import Model, Segmentor, Classifier
+from models.Backends import (OnnxSession, backend_tag, channels_last_copy, export_onnx, max_abs_diff, onnx_path,
+                             quantize_linear, quantize_onnx, set_threads, trace_module, warm_up)
+from models.ResultStore import weights_fingerprint
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 IMG_SIZE = 64
+MAX_BATCH = 256
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 transform = Compose([Resize((IMG_SIZE, IMG_SIZE)), ToTensor()])
 
 
 class TorchMaterialClassifier(Classifier):
+    WEIGHTS_PATH = "C:/VLNLP/Test/D7K/COCO/material_classifier.pth"
     MATERIAL_CLASSES = ["opaque", "transparent", "transparent_blue", "mirror", "gold"]
 
     def __init__(self):
         super().__init__("TorchMaterialClassifier")
-        path = "C:/VLNLP/Test/D7K/COCO/material_classifier.pth"
+        path = self.WEIGHTS_PATH
 
         class MaterialNet(torch.nn.Module):
             def __init__(self):
@@ -39,12 +45,86 @@ class TorchMaterialClassifier(Classifier):
         state_dict = torch.load(path, map_location=device)
         self.full_model.load_state_dict(state_dict)
         self.full_model.to(device).eval()
+        self.backend_tag = ""
+        self._forward = self.full_model
+        self._channels_last = False
+
+    def _example_input(self, batch: int = 8) -> torch.Tensor:
+        generator = torch.Generator().manual_seed(0)
+        return torch.rand(batch, 3, IMG_SIZE, IMG_SIZE, generator=generator).to(device)
+
+    def _logits(self, tensor: torch.Tensor) -> torch.Tensor:
+        if self._channels_last:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            output = self._forward(tensor)
+        return output[0] if isinstance(output, list) else output
+
+    def configure_backend(self, backend: str = "eager", quantize: bool = False, channels_last: bool = False,
+                          export_dir: Optional[str] = None, parity_atol: Optional[float] = None,
+                          threads: Optional[int] = None) -> dict:
+        """Run inference through backend ("eager", "torchscript" or "onnx"); returns the parity report vs eager.
+
+        quantize applies dynamic int8 quantization to MaterialNet's Linear layers (CPU only);
+        channels_last feeds NHWC tensors. The ONNX graph is exported once per weight file into
+        export_dir (default: an onnx folder next to the weights). Outputs on a fixed random batch
+        are compared with plain eager; a max difference above parity_atol (default 1e-3, or no
+        limit when quantizing) raises RuntimeError and leaves the model on eager. threads sets
+        torch's intra-op thread count (process-wide) or, for ONNX, the session's.
+        """
+        tag = backend_tag(backend, quantize, channels_last)
+        if quantize and device.type != "cpu":
+            raise ValueError("Dynamic int8 quantization runs on the CPU only")
+        set_threads(backend, threads)
+        example = self._example_input()
+        with torch.inference_mode():
+            reference = self.full_model(example)
+
+        module = quantize_linear(self.full_model) if quantize and backend != "onnx" else self.full_model
+        if channels_last:
+            module = channels_last_copy(module)
+        if backend == "torchscript":
+            forward = trace_module(module, example)
+        elif backend == "onnx":
+            folder = export_dir or os.path.join(os.path.dirname(self.WEIGHTS_PATH), "onnx")
+            target = onnx_path(folder, type(self).__name__, weights_fingerprint(self.WEIGHTS_PATH))
+            path = export_onnx(module, (example,), target, ["crops"], ["logits"],
+                               {"crops": {0: "batch"}, "logits": {0: "batch"}})
+            forward = OnnxSession(quantize_onnx(path) if quantize else path, threads)
+        else:
+            forward = module
+
+        previous = self._forward, self._channels_last
+        self._forward, self._channels_last = forward, channels_last
+        candidate = self._logits(example)
+        report = {
+            "backend": tag or "eager",
+            "max_abs_diff": max_abs_diff([reference], [candidate]),
+            "agreement": (reference.argmax(dim=1) == candidate.argmax(dim=1)).float().mean().item(),
+        }
+        limit = parity_atol if parity_atol is not None else (None if quantize else 1e-3)
+        if limit is not None and report["max_abs_diff"] > limit:
+            self._forward, self._channels_last = previous
+            raise RuntimeError(f"{type(self).__name__} {report['backend']} output differs from eager: {report}")
+        self.backend_tag = tag
+        return report
+
+    def warm_up(self, runs: int = 1) -> None:
+        warm_up(lambda: self._logits(self._example_input()), runs)
 
     def get_supported_attribute(self) -> str:
         return "material"
 
     def predict(self, image: Image.Image) -> str:
         tensor = transform(image).unsqueeze(0).to(device)
-        with torch.no_grad():
-            pred = self.full_model(tensor)
+        pred = self._logits(tensor)
         return self.MATERIAL_CLASSES[pred.argmax().item()]
+
+    def predict_batch(self, images: List[Image.Image]) -> List[str]:
+        results = []
+        for start in range(0, len(images), MAX_BATCH):
+            chunk = images[start:start + MAX_BATCH]
+            tensor = torch.stack([transform(image) for image in chunk]).to(device)
+            pred = self._logits(tensor)
+            results.extend(self.MATERIAL_CLASSES[i] for i in pred.argmax(dim=1).tolist())
+        return results
@@ -8,6 +8,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from torchvision.transforms import Compose, Resize, ToTensor
 from torchvision.models.detection import maskrcnn_resnet50_fpn
+from models.Detection import Detection
 
 
 
@@ -36,9 +37,18 @@ class Segmentor(Model):
         pass
 
     @abstractmethod
-    def predict(self, image: Image.Image) -> List[Tuple[Image.Image, Image.Image, str]]:
+    def predict(self, image: Image.Image) -> List[Union[Detection, Tuple[Image.Image, Image.Image, str]]]:
+        """Detections as Detection records (or legacy (crop, mask, label) tuples).
+
+        Segmentors may accept post-processing keywords (score_threshold, top_k, nms_iou);
+        they are only passed when a query sets them.
+        """
         pass
 
+    def predict_batch(self, images: List[Image.Image]) -> List[List[Union[Detection, Tuple[Image.Image, Image.Image, str]]]]:
+        """Segment several images; returns one detection list per image, in input order."""
+        return [self.predict(image) for image in images]
+
 class Classifier(Model):
     def __init__(self, name: str):
         super().__init__(name)
@@ -49,4 +59,8 @@ class Classifier(Model):
 
     @abstractmethod
     def predict(self, image: Image.Image) -> str:
-        pass
\ No newline at end of file
+        pass
+
+    def predict_batch(self, images: List[Image.Image]) -> List[str]:
+        """Classify several crops at once; models without a batched path fall back to a loop."""
+        return [self.predict(image) for image in images]
\ No newline at end of file
@@ -1,4 +1,5 @@
-from lark import Lark, Tree, Token
+from lark import Tree, Token
+from Core.Grammar import get_parser
 import random
 
 class ObjectType:
@@ -19,6 +20,9 @@ class SceneObject:
         self.type = type_name
         self.attributes = {}
         self.ObjectList = {}
+        # Type name -> objects of that type in the whole hierarchy; only the root keeps one.
+        self.root = self
+        self.type_index = {type_name: [self]}
 
     def setup(self, obj_type):
         for attr in obj_type.attributes:
@@ -30,6 +34,13 @@ class SceneObject:
         if obj.type not in self.ObjectList:
             self.ObjectList[obj.type] = []
         self.ObjectList[obj.type].append(obj)
+        if obj.type_index is not None:
+            root = self.root
+            for type_name, objs in obj.type_index.items():
+                root.type_index.setdefault(type_name, []).extend(objs)
+                for o in objs:
+                    o.root = root
+                    o.type_index = None
 
     def get(self, key):
         if key in self.attributes:
@@ -38,14 +49,19 @@ class SceneObject:
             return self.ObjectList[key]
         return None
 
+    def iter_all(self, type_name):
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            if obj.type == type_name:
+                yield obj
+            for lst in reversed(list(obj.ObjectList.values())):
+                stack.extend(reversed(lst))
+
     def find_all(self, type_name):
-        results = []
-        if self.type == type_name:
-            results.append(self)
-        for lst in self.ObjectList.values():
-            for child in lst:
-                results.extend(child.find_all(type_name))
-        return results
+        if self.type_index is not None:
+            return list(self.type_index.get(type_name, ()))
+        return list(self.iter_all(type_name))
 
     def __str__(self, indent=0):
         pad = "  " * indent
@@ -106,9 +122,6 @@ def ShapeCountLimit(scene):
 
 # === Main Execution ===
 if __name__ == "__main__":
-    with open('grammar.lark', 'r') as f:
-        grammar_text = f.read()
-
     example_dsl = """
     type Object1 {
       attributes: [shape, mat]
@@ -121,7 +134,7 @@ if __name__ == "__main__":
     }
     """
 
-    parser = Lark(grammar_text, start="start", parser="lalr")
+    parser = get_parser()
     tree = parser.parse(example_dsl)
 
     print("\n=== TYPES ===")
@@ -0,0 +1,39 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Query
+from models.DetectionCache import DetectionCache
+from models.StubModels import StubSegmentor
+from Core.Benchmark import stub_registry
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    """Point the process-wide registry and caches at the zero-latency stub models."""
+    registry = stub_registry(0.0)
+    monkeypatch.setattr(Query, "_SHARED_REGISTRY", registry)
+    monkeypatch.setattr(Query, "DETECTION_CACHE", DetectionCache())
+    monkeypatch.setattr(Query, "RESULT_STORE", None)
+    return registry
+
+
+@pytest.fixture
+def segmentor_calls(monkeypatch):
+    """Images passed to the stub segmentor, counted per entry point."""
+    calls = {"predict": 0, "predict_batch": 0}
+    predict, predict_batch = StubSegmentor.predict, StubSegmentor.predict_batch
+
+    def counted_predict(self, image):
+        calls["predict"] += 1
+        return predict(self, image)
+
+    def counted_predict_batch(self, images):
+        calls["predict_batch"] += len(images)
+        return predict_batch(self, images)
+
+    monkeypatch.setattr(StubSegmentor, "predict", counted_predict)
+    monkeypatch.setattr(StubSegmentor, "predict_batch", counted_predict_batch)
+    return calls
@@ -0,0 +1,73 @@
+import pytest
+import torch
+from models.Backends import (OnnxSession, channels_last_copy, export_onnx, matched_detection_diff, max_rel_diff,
+                             quantize_linear, trace_module)
+
+
+class _Net(torch.nn.Module):
+    """Conv features into a Linear head, the shape of the classifier the backends are used on."""
+
+    def __init__(self):
+        super().__init__()
+        self.features = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3, padding=1), torch.nn.ReLU(),
+                                            torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+        self.head = torch.nn.Linear(8, 5)
+
+    def forward(self, x):
+        return self.head(self.features(x))
+
+
+@pytest.fixture
+def net():
+    torch.manual_seed(0)
+    return _Net().eval()
+
+
+def _inputs(batch=3):
+    return torch.rand(batch, 3, 32, 32, generator=torch.Generator().manual_seed(1))
+
+
+def _eager(net, x):
+    with torch.no_grad():
+        return [net(x)]
+
+
+def test_torchscript_matches_eager(net):
+    x = _inputs()
+    traced = trace_module(net, x[:1])
+    with torch.no_grad():
+        assert max_rel_diff(_eager(net, x), [traced(x)]) < 1e-5
+
+
+def test_int8_stays_close_to_eager(net):
+    x = _inputs()
+    with torch.no_grad():
+        assert max_rel_diff(_eager(net, x), [quantize_linear(net)(x)]) < 5e-2
+
+
+def test_channels_last_copy_matches_eager(net):
+    x = _inputs()
+    with torch.no_grad():
+        nhwc = channels_last_copy(net)(x.contiguous(memory_format=torch.channels_last))
+    assert max_rel_diff(_eager(net, x), [nhwc]) < 1e-5
+
+
+def test_onnx_matches_eager(net, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    x = _inputs()
+    path = export_onnx(net, (x[:1],), str(tmp_path / "net.onnx"), ["images"], ["logits"],
+                       {"images": {0: "batch"}, "logits": {0: "batch"}})
+    # The export is made at batch 1; the dynamic batch axis must carry the whole batch through.
+    assert max_rel_diff(_eager(net, x), OnnxSession(path)(x)) < 1e-5
+    assert export_onnx(net, (x[:1],), path, ["images"], ["logits"], {}) == path
+
+
+def test_matched_detection_diff_ignores_the_order_of_tied_scores():
+    reference = {"boxes": torch.tensor([[0., 0., 10., 10.], [50., 50., 90., 90.]]),
+                 "scores": torch.tensor([0.9, 0.9]), "labels": torch.tensor([1, 2])}
+    swapped = {key: value.flip(0) for key, value in reference.items()}
+    assert matched_detection_diff(reference, swapped) == 0.0
+    relabelled = {**swapped, "labels": torch.tensor([1, 2])}
+    assert matched_detection_diff(reference, relabelled) > 0.5
+    assert matched_detection_diff(reference, {key: value[:1] for key, value in reference.items()}) == float("inf")
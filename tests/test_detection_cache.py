@@ -0,0 +1,27 @@
+from models import Query
+from models.DetectionCache import DetectionCache
+from Core.Benchmark import random_images
+
+
+def test_label_queries_share_one_segmentor_pass(stub_models, segmentor_calls):
+    images = random_images(3, seed=6)
+    for label in ("cube", "sphere", "cone"):
+        for image in images:
+            Query.query(image, label, stub_models)
+    assert segmentor_calls == {"predict": 3, "predict_batch": 0}
+    stats = Query.DETECTION_CACHE.stats()
+    assert (stats["misses"], stats["hits"], stats["entries"]) == (3, 6, 3)
+
+
+def test_eviction_skips_pinned_entries():
+    cache = DetectionCache(max_entries=2)
+    images = random_images(4, seed=8)
+    cache.pin("seg", images[0])
+    for image in images:
+        cache.put("seg", image, [])
+    assert cache.stats()["evictions"] == 2
+    cache.unpin("seg", images[0])
+    # Released, the formerly pinned entry is the oldest and goes first.
+    cache.put("seg", images[1], [])
+    assert cache.get("seg", images[0]) is None and cache.get("seg", images[3]) == []
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 3, "entries": 2, "bytes": 0}
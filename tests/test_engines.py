@@ -0,0 +1,57 @@
+import pytest
+from Core.Benchmark import BENCH_DSL, random_images, random_scenes
+from Core.Grammar import parse_dsl
+from Core.RuleAnalysis import order_by_cost
+from Core.RuleCompiler import compile_rules, run_rule
+from Core.SceneObject import SceneObject, extract_object_types
+from Core.SceneRunner import check_scene
+from Core.VectorEval import check_batch, lower_rules
+
+TREE = parse_dsl(BENCH_DSL)
+TYPE_MAP = {t.name: t for t in extract_object_types(TREE)}
+RULE_TREES = {stmt.children[0].value: stmt for stmt in TREE.find_data("rule_def")}
+# Cost order, as run_program uses under stop_after.
+NAMES = order_by_cost(list(RULE_TREES), RULE_TREES, TYPE_MAP)
+
+
+def _rules():
+    compiled, vector = compile_rules(TREE), lower_rules(TREE)
+    return [compiled[name] for name in NAMES], [vector[name] for name in NAMES]
+
+
+def _stub_scenes(registry, images):
+    roots = []
+    for image in images:
+        root = SceneObject("Scene", "Scene", source_image=image, model_registry=registry)
+        root.setup(TYPE_MAP["Scene"])
+        roots.append(root)
+    return roots
+
+
+@pytest.mark.parametrize("stop_after", [None, 1, 2])
+def test_engines_agree_on_replayed_scenes(stop_after):
+    roots = random_scenes(TREE, "Scene", 200, seed=3, max_depth=4, fan_out=4)
+    compiled, vector = _rules()
+    expected = [check_scene(compiled, root, stop_after) for root in roots]
+    assert check_batch(vector, roots, stop_after) == expected
+    assert any(expected)
+    if stop_after is not None:
+        assert max(len(results) for results in expected) == stop_after
+
+
+def test_shared_memo_matches_separate_rules():
+    roots = random_scenes(TREE, "Scene", 100, seed=4, max_depth=4, fan_out=4)
+    compiled, _ = _rules()
+    for root in roots:
+        separate = [result for result in (run_rule(rule, root) for rule in compiled) if result]
+        assert check_scene(compiled, root) == separate
+
+
+@pytest.mark.parametrize("stop_after", [None, 1, 2])
+def test_engines_agree_on_stub_model_scenes(stub_models, stop_after):
+    images = random_images(12, seed=5)
+    compiled, vector = _rules()
+    # Each engine resolves its own hierarchies, so neither reads what the other asked the models.
+    expected = [check_scene(compiled, root, stop_after) for root in _stub_scenes(stub_models, images)]
+    assert check_batch(vector, _stub_scenes(stub_models, images), stop_after) == expected
+    assert any(expected)
@@ -0,0 +1,44 @@
+import pytest
+from Core.Benchmark import BENCH_DSL, random_images
+from Core.Grammar import parse_dsl
+from Core.Incremental import run_incremental
+from models import Query
+from models.StubModels import StubSegmentor
+
+CHECK = """
+scene1 = LoadScene("{folder}", Scene)
+scene1.Check(0, end, [ManyCubes, GoldCube, Rain])
+"""
+IMAGES = 4
+
+
+@pytest.fixture
+def program(tmp_path):
+    folder = tmp_path / "scenes"
+    folder.mkdir()
+    for n, image in enumerate(random_images(IMAGES, seed=9)):
+        image.save(folder / f"scene_{n:02d}.png")
+    return parse_dsl(BENCH_DSL + CHECK.format(folder=folder.as_posix()))
+
+
+def _run(tree, tmp_path):
+    # A fresh in-memory cache per run, as in a new process; only the results file and snapshots carry over.
+    Query.DETECTION_CACHE.clear()
+    return list(run_incremental(tree, str(tmp_path / "results.jsonl"), str(tmp_path / "snapshots")))
+
+
+def test_unchanged_run_reuses_results(stub_models, segmentor_calls, program, tmp_path):
+    first = _run(program, tmp_path)
+    assert segmentor_calls["predict"] == IMAGES
+    assert _run(program, tmp_path) == first
+    assert segmentor_calls["predict"] == IMAGES
+
+
+def test_new_weights_invalidate_results_and_snapshots(stub_models, segmentor_calls, program, tmp_path,
+                                                      monkeypatch):
+    first = _run(program, tmp_path)
+    weights = tmp_path / "stub.pth"
+    weights.write_bytes(b"retrained")
+    monkeypatch.setattr(StubSegmentor, "WEIGHTS_PATH", str(weights))
+    assert _run(program, tmp_path) == first
+    assert segmentor_calls["predict"] == 2 * IMAGES
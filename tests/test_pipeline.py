@@ -0,0 +1,38 @@
+from Core.Benchmark import BENCH_DSL, random_images
+from Core.Grammar import parse_dsl
+from Core.Pipeline import check_pipeline
+from Core.RuleAnalysis import ruleset_requirements
+from Core.RuleCompiler import compile_rules
+from Core.SceneObject import extract_object_types, make_hierarchy
+from Core.SceneRunner import check_scene, load_image
+from models import Query
+
+TREE = parse_dsl(BENCH_DSL)
+TYPE_MAP = {t.name: t for t in extract_object_types(TREE)}
+RULES = list(compile_rules(TREE).values())
+
+
+def _save(folder, count, seed):
+    paths = []
+    for n, image in enumerate(random_images(count, seed=seed)):
+        paths.append(str(folder / f"scene_{n:03d}.png"))
+        image.save(paths[-1])
+    return paths
+
+
+def test_pipeline_segments_each_image_once(stub_models, segmentor_calls, tmp_path):
+    # Far more images than the detection cache holds, so queued chunks would otherwise be evicted.
+    paths = _save(tmp_path, 120, seed=11)
+    requirements = ruleset_requirements(TREE.find_data("rule_def"), TYPE_MAP)
+    results = list(check_pipeline(paths, TYPE_MAP, "Scene", RULES, batch_size=4, requirements=requirements))
+    assert [path for path, _ in results] == paths
+    assert segmentor_calls == {"predict": 0, "predict_batch": len(paths)}
+    assert len(Query.DETECTION_CACHE) <= Query.DETECTION_CACHE.max_entries
+
+
+def test_pipeline_matches_sequential_checks(stub_models, tmp_path):
+    paths = _save(tmp_path, 10, seed=12)
+    piped = dict(check_pipeline(paths, TYPE_MAP, "Scene", RULES, batch_size=3))
+    for path in paths:
+        root = make_hierarchy("Scene", TYPE_MAP, load_image(path))
+        assert piped[path] == check_scene(RULES, root)
@@ -0,0 +1,46 @@
+import copy
+from Core.Grammar import parse_dsl
+from Core.RuleAnalysis import ruleset_requirements
+from Core.SceneObject import SceneObject
+from Core.Benchmark import random_images
+from models.Query import is_attribute_key, is_object_key, models_for_keys
+from models.Registry import ModelRegistry
+from models.StubModels import STUB_REGISTRY_JSON
+
+DSL = """
+type Scene {
+  attributes: []
+  objects: [Gadget*]
+}
+rule Shiny(s: Scene) {
+  for g in s.Gadget do {
+    if g.finish = "gold" then {
+      contradiction 1
+    }
+  }
+}
+"""
+
+def _renamed_registry():
+    """The stub models under keys the process-wide registry doesn't know."""
+    entries = copy.deepcopy(STUB_REGISTRY_JSON)
+    entries[0]["ObjectType"] = ["Gadget"]
+    entries[1]["ATTR"] = "finish"
+    return ModelRegistry(entries)
+
+
+def test_keys_resolve_through_the_given_registry():
+    registry = _renamed_registry()
+    assert is_attribute_key("finish", registry) and not is_attribute_key("finish")
+    assert is_object_key("Gadget", registry) and not is_object_key("Gadget")
+    assert models_for_keys(["Gadget", "finish"], registry) == ["StubSegmentor", "StubClassifier"]
+
+
+def test_scene_and_analysis_use_the_store_registry():
+    registry = _renamed_registry()
+    root = SceneObject("Scene", "Scene", source_image=random_images(1, seed=2)[0], model_registry=registry)
+    assert isinstance(root.get("finish"), str)
+    tree = parse_dsl(DSL)
+    requirements = ruleset_requirements(tree.find_data("rule_def"), {}, registry)
+    assert requirements.models() == ["StubSegmentor", "StubClassifier"]
+    assert ("Gadget", "finish") in requirements.reads
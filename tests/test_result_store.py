@@ -0,0 +1,36 @@
+import numpy as np
+from models.Detection import BoxMask, Detection
+from models.ResultStore import ResultStore
+from models.StubModels import StubClassifier, StubSegmentor
+from Core.Benchmark import random_images
+
+
+def _detections(image):
+    rng = np.random.default_rng(0)
+    boxes = [(2, 3, 12, 9), (20, 0, 27, 14), (0, 0, 1, 1)]
+    return [Detection(box, label, score, image, BoxMask(rng.random((box[3] - box[1], box[2] - box[0])) > 0.5,
+                                                        box, image.size))
+            for box, label, score in zip(boxes, ["cube", "sphere", "cube"], [0.75, 0.625, None])]
+
+
+def test_detections_round_trip(tmp_path):
+    image = random_images(1, seed=1)[0]
+    store, model = ResultStore(str(tmp_path / "store.sqlite")), StubSegmentor()
+    detections = _detections(image)
+    store.put_detections("img", model, "", detections)
+    stored = store.get_detections("img", model, "", image)
+    assert [(d.box, d.label, d.score) for d in stored] == [(d.box, d.label, d.score) for d in detections]
+    for original, restored in zip(detections, stored):
+        assert np.array_equal(restored.mask_patch(), original.mask_patch())
+        assert np.array_equal(restored.mask_array(), original.mask_array())
+    assert store.get_detections("img", model, "max512", image) is None
+    store.put_detections("empty", model, "", [])
+    assert store.get_detections("empty", model, "", image) == []
+    store.close()
+
+
+def test_attributes_round_trip(tmp_path):
+    store, model = ResultStore(str(tmp_path / "store.sqlite")), StubClassifier()
+    store.put_attributes({"a": "red", "b": "gold"}, model)
+    assert store.get_attributes(["a", "b", "c"], model) == {"a": "red", "b": "gold"}
+    store.close()
@@ -0,0 +1,46 @@
+import os
+import pytest
+from Core.ResultsWriter import ResultsWriter, read_header, read_results, repair
+
+
+def _write(path, count, **options):
+    with ResultsWriter(path, **options) as writer:
+        writer.write_header({"rules": {}})
+        for index in range(count):
+            writer.write({"scene": "s", "image": f"{index}.png", "index": index})
+
+
+def test_repair_drops_torn_last_line(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    _write(path, 5)
+    with open(path, "ab") as f:
+        f.write(b'{"scene": "s", "ima')
+    repair(path)
+    assert [r["index"] for r in read_results(path)] == list(range(5))
+    with ResultsWriter(path) as writer:
+        writer.write({"scene": "s", "image": "5.png", "index": 5})
+    assert [r["index"] for r in read_results(path)] == list(range(6))
+
+
+def test_repair_truncated_gzip(tmp_path):
+    path = str(tmp_path / "results.jsonl.gz")
+    _write(path, 200, flush_every=10)
+    with open(path, "rb+") as f:
+        f.truncate(os.path.getsize(path) * 2 // 3)
+    repair(path)
+    kept = [r["index"] for r in read_results(path)]
+    assert kept and kept == list(range(len(kept)))
+    assert read_header(path)["rules"] == {}
+    # A repaired gzip file takes new members again.
+    with ResultsWriter(path) as writer:
+        writer.write({"scene": "s", "image": "x.png", "index": len(kept)})
+    assert [r["index"] for r in read_results(path)] == list(range(len(kept) + 1))
+
+
+@pytest.mark.parametrize("name", ["results.jsonl", "results.jsonl.gz"])
+def test_repair_leaves_intact_files_alone(tmp_path, name):
+    path = str(tmp_path / name)
+    _write(path, 3)
+    before = open(path, "rb").read()
+    repair(path)
+    assert open(path, "rb").read() == before
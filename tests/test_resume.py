@@ -0,0 +1,65 @@
+import itertools
+import pytest
+from Core.Benchmark import BENCH_DSL, random_images
+from Core.Grammar import parse_dsl
+from Core.ResultsWriter import ResultsWriter, read_results
+from Core.SceneRunner import resolve_bound, run_program
+
+CHECK = """
+scene1 = LoadScene("{folder}", Scene)
+scene1.Check(start, end, [ManyCubes, GoldCube, Rain])
+"""
+IMAGES = 6
+
+
+@pytest.fixture
+def program(tmp_path):
+    folder = tmp_path / "scenes"
+    folder.mkdir()
+    for n, image in enumerate(random_images(IMAGES, seed=7)):
+        image.save(folder / f"scene_{n:02d}.png")
+    return parse_dsl(BENCH_DSL + CHECK.format(folder=folder.as_posix()))
+
+
+def _run(tree, path, checkpoint=None, limit=None, **options):
+    """Records of one run_program call; with limit, the run is abandoned after that many."""
+    writer = ResultsWriter(str(path))
+    records = run_program(tree, writer=writer, checkpoint=checkpoint, checkpoint_every=2, workers=1, **options)
+    try:
+        return list(itertools.islice(records, limit))
+    finally:
+        records.close()
+        writer.close()
+
+
+def test_resume_after_interrupted_run(stub_models, program, tmp_path):
+    full = _run(program, tmp_path / "full.jsonl")
+    path, checkpoint = tmp_path / "out.jsonl", str(tmp_path / "progress.json")
+    first = _run(program, path, checkpoint, limit=3)
+    rest = _run(program, path, checkpoint)
+    # The checkpoint covers two images; the third is skipped because the results file already holds it.
+    assert [r["index"] for r in rest] == [3, 4, 5]
+    assert first + rest == full
+    assert list(read_results(str(path))) == full
+
+
+def test_stop_after_run_is_not_resumed_by_a_full_run(stub_models, program, tmp_path):
+    path, checkpoint = tmp_path / "out.jsonl", str(tmp_path / "progress.json")
+    _run(program, path, checkpoint, limit=3, stop_after=1)
+    rest = _run(program, path, checkpoint)
+    assert [r["index"] for r in rest] == list(range(IMAGES))
+    assert rest == _run(program, tmp_path / "full.jsonl")
+
+
+def test_negative_start_numbers_images_by_folder_position(stub_models, program, tmp_path):
+    records = _run(program, tmp_path / "out.jsonl", bindings={"start": -2})
+    assert [r["index"] for r in records] == [IMAGES - 2, IMAGES - 1]
+    assert [r["image"].rsplit("_", 1)[1] for r in records] == [f"{IMAGES - 2:02d}.png", f"{IMAGES - 1:02d}.png"]
+
+
+def test_non_integer_bound_is_rejected(stub_models, tmp_path):
+    tree = parse_dsl(BENCH_DSL + CHECK.format(folder=tmp_path.as_posix()).replace("start", "1.5"))
+    with pytest.raises(ValueError, match="must be an integer: 1.5"):
+        _run(tree, tmp_path / "out.jsonl")
+    with pytest.raises(ValueError, match="Unbound Check\\(\\) argument: middle"):
+        resolve_bound("middle", {})
@@ -0,0 +1,40 @@
+from Core.Grammar import parse_dsl
+from Core.RuleAnalysis import rule_requirements
+from Core.SceneObject import extract_object_types
+
+DSL = """
+type Scene {
+  attributes: [weather]
+  objects: [Bird*, Cloud*]
+}
+type Bird {
+  attributes: [color]
+  objects: []
+}
+type Cloud {
+  attributes: []
+  objects: []
+}
+rule StormyBirds(s: Scene) {
+  for b in s.Bird do {
+    if count(s.Cloud) > 1 then {
+      contradiction 1
+    }
+    if s.weather = "rain" then {
+      contradiction 2
+    }
+    if b.color = "red" then {
+      contradiction 3
+    }
+  }
+}
+"""
+
+
+def test_loop_conditions_on_the_rule_parameter_are_not_charged_to_the_loop():
+    tree = parse_dsl(DSL)
+    type_map = {t.name: t for t in extract_object_types(tree)}
+    requirements = rule_requirements(next(tree.find_data("rule_def")), type_map)
+    assert requirements.object_keys == {"Bird", "Cloud"}
+    assert requirements.attributes == {"weather", "color"}
+    assert requirements.reads == {("Bird", "color")}
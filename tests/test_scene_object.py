@@ -0,0 +1,53 @@
+from Core.SceneObject import SceneObject
+
+
+def _obj(type_name):
+    return SceneObject(type_name, type_name, model_registry={})
+
+
+def test_views_of_an_adopted_subtree_write_to_the_new_tree():
+    root, a, b = _obj("Root"), _obj("A"), _obj("B")
+    a.add_object(b)
+    root.add_object(a)
+    b.attributes["color"] = "red"
+    b.add_object(_obj("C"))
+    assert b.store is root.store and a.store is root.store
+    assert root.ObjectList["A"][0].ObjectList["B"][0].attributes["color"] == "red"
+    assert [obj.type for obj in root.find_all("C")] == ["C"]
+
+
+def test_object_from_another_tree_is_copied():
+    root, other, child = _obj("Root"), _obj("Root"), _obj("Q")
+    other.add_object(child)
+    root.add_object(child)
+    child.attributes["color"] = "blue"
+    assert child.store is other.store
+    assert root.ObjectList["Q"][0].attributes.get("color") is None
+
+
+def test_unhashable_attribute_values_are_stored_as_given():
+    obj = _obj("Root")
+    obj.attributes["tags"] = ["red", "shiny"]
+    obj.attributes["meta"] = {"score": 1}
+    other = _obj("Root")
+    obj.add_object(other)
+    other.attributes["tags"] = ["red", "shiny"]
+    assert obj.attributes["tags"] == ["red", "shiny"] and other.attributes["tags"] == ["red", "shiny"]
+    assert obj.attributes["meta"] == {"score": 1}
+    obj.attributes["tags"] = "plain"
+    assert obj.attributes["tags"] == "plain"
+
+
+def test_find_all_skips_objects_dropped_from_the_tree():
+    root, a = _obj("Root"), _obj("A")
+    root.add_object(a)
+    for _ in range(3):
+        a.add_object(_obj("B"))
+    assert len(root.find_all("B")) == 3 and not root.store.detached
+    kept = a.ObjectList["B"][1]
+    a.ObjectList["B"] = [kept]
+    assert root.store.detached
+    # The type index still lists the dropped rows, so the lookup falls back to a walk of the tree.
+    assert [obj.row for obj in root.find_all("B")] == [kept.row]
+    del root.ObjectList["A"]
+    assert root.find_all("B") == [] and root.find_all("A") == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import torch
+from models import TorchMaskRCNNShapeWSegmentor as segmentor
+from models.TorchMaskRCNNShapeWSegmentor import MASK_THRESHOLD, TorchMaskRCNNShapeWSegmentor, _padded_batches
+
+
+def _random_boxes(count, height, width, seed):
+    rng = np.random.default_rng(seed)
+    regions, sizes = [], []
+    for _ in range(count):
+        left, top = rng.integers(0, width - 1), rng.integers(0, height - 1)
+        regions.append((left, top, rng.integers(left + 1, width + 1), rng.integers(top + 1, height + 1)))
+        sizes.append((rng.integers(1, 90), rng.integers(1, 90)))
+    return np.array(regions), np.array(sizes)
+
+
+@pytest.mark.parametrize("budget", [segmentor.MASK_BATCH_PIXELS, 5000])
+def test_box_masks_match_per_box_interpolation(monkeypatch, budget):
+    monkeypatch.setattr(segmentor, "MASK_BATCH_PIXELS", budget)
+    generator = torch.Generator().manual_seed(0)
+    probabilities = torch.nn.functional.interpolate(torch.rand(12, 1, 8, 8, generator=generator), size=(64, 80),
+                                                    mode="bilinear")[:, 0]
+    regions, sizes = _random_boxes(12, 64, 80, seed=0)
+    patches = TorchMaskRCNNShapeWSegmentor._box_masks(probabilities, regions, sizes)
+    for k, (left, top, right, bottom) in enumerate(regions.tolist()):
+        expected = torch.nn.functional.interpolate(probabilities[k, top:bottom, left:right][None, None],
+                                                   size=tuple(sizes[k].tolist()), mode="bilinear",
+                                                   align_corners=False)[0, 0] > MASK_THRESHOLD
+        np.testing.assert_array_equal(patches[k], expected.numpy())
+
+
+def test_padded_batches_stay_within_budget():
+    heights, widths = [10, 40, 5, 30, 30], [10, 10, 50, 30, 30]
+    batches = list(_padded_batches(heights, widths, budget=2000))
+    assert [i for part in batches for i in range(len(heights))[part]] == list(range(len(heights)))
+    for part in batches:
+        count = part.stop - part.start
+        assert count == 1 or count * max(heights[part]) * max(widths[part]) <= 2000
+
+
+def test_box_crops_match_thresholded_frame_masks():
+    generator = torch.Generator().manual_seed(1)
+    masks = torch.rand(5, 40, 60, generator=generator)
+    boxes = np.array([[0, 0, 60, 40], [10, 5, 11, 6], [50, 30, 70, 45], [20, 20, 20, 25], [3, 7, 33, 19]])
+    patches = TorchMaskRCNNShapeWSegmentor._box_crops(masks, boxes)
+    for mask, (x0, y0, x1, y1), patch in zip(masks, boxes.tolist(), patches):
+        np.testing.assert_array_equal(patch, (mask > MASK_THRESHOLD).numpy()[y0:y1, x0:x1])
+        assert patch.dtype == np.bool_